@@ -0,0 +1,166 @@
+'''
+Batch EnergyPlus runner for uncontrolled baselines, without HELICS.
+
+Runs every building IDF written by process_input.py (energyplus/idf) with fixed setpoints, in a
+process pool with one EnergyPlus state per building, and sums the Electricity:Facility meter of
+all buildings into one aggregate demand series. The mean and standard deviation of the aggregate
+are the MU and SIGMA of the supplier's z-score price; they do not include the distribution losses
+of the secondary circuit.
+
+Usage, from the energyplus directory:
+    python ../baseline.py           writes baseline.npz and prints MU and SIGMA
+    python ../baseline.py pricing   also writes the z-score price model to ../input/pricing.json
+
+If a building fails, nothing is written and the runner exits nonzero, as MU and SIGMA of the other
+buildings would calibrate the price to a different set of buildings than the one simulated. With
+--partial, the buildings that ran are used anyway.
+'''
+import os
+import sys
+import json
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+# Fixed temperature setpoint tolerance in Celsius, the 2 degrees Farenheit of the supplier's
+# uncontrolled run
+TOLERANCE = 2*(5/9)
+
+# Length of a zone timestep in seconds
+TIMESTEP = 15*60
+
+# Number of worker processes, the available cores if None
+MAX_WORKERS = None
+
+# Weather file, output directory of the EnergyPlus runs and results file
+WEATHER_FILE = '../input/USA_WA_Seattle-Tacoma.Intl.AP.727930_TMY3.epw'
+OUTPUT_DIR = 'output/baseline'
+BASELINE_FILE = 'baseline.npz'
+
+# EnergyPlus API of the worker process, see init_worker
+api = None
+
+
+def init_worker():
+    '''
+    Imports the EnergyPlus API once per worker process.
+    '''
+    global api
+    sys.path.insert(1, "/usr/local/EnergyPlus-9-5-0")
+    from pyenergyplus.api import EnergyPlusAPI
+    api = EnergyPlusAPI()
+
+
+def simulate(case):
+    '''
+    Runs idf/{case}.idf with fixed setpoints. Returns the case, its consumption in W at every
+    primary run period timestep, and None, or the case, None and the error if EnergyPlus failed.
+    '''
+    state = api.state_manager.new_state()
+    handles = {}
+    consumption = []
+
+    def get_handle(state):
+        handles['meter'] = api.exchange.get_meter_handle(state, "Electricity:Facility".upper())
+        handles['cooling'] = api.exchange.get_actuator_handle(
+            state, "Schedule:Constant", "Schedule Value", "cooling_setpoint"
+        )
+        handles['heating'] = api.exchange.get_actuator_handle(
+            state, "Schedule:Constant", "Schedule Value", "heating_setpoint"
+        )
+
+    def record(state):
+        # Only the primary run period, as in building.py
+        if (api.exchange.kind_of_sim(state) == 3) and not api.exchange.warmup_flag(state):
+            consumption.append(api.exchange.get_meter_value(state, handles['meter'])/TIMESTEP)
+            api.exchange.set_actuator_value(state, handles['cooling'], 22.22 + TOLERANCE)
+            api.exchange.set_actuator_value(state, handles['heating'], 22.22 - TOLERANCE)
+
+    api.runtime.callback_end_zone_sizing(state, get_handle)
+    api.runtime.callback_end_zone_timestep_after_zone_reporting(state, record)
+    status = api.runtime.run_energyplus(
+        state = state,
+        command_line_args = [
+            '-d', f'{OUTPUT_DIR}/{case}',
+            '-w', WEATHER_FILE,
+            f'idf/{case}.idf'
+        ]
+    )
+    api.state_manager.delete_state(state)
+    if status != 0:
+        return case, None, f'EnergyPlus failed with status {status}'
+    return case, np.array(consumption), None
+
+
+def available_cores():
+    '''
+    Returns the number of cores this process may run on.
+    '''
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def run_baseline(cases, max_workers=MAX_WORKERS):
+    '''
+    Simulates the cases in a process pool. Returns the aggregate consumption in W at every
+    timestep, the total consumption of every case in Wh (NaN if it failed), and the failed cases.
+    '''
+    max_workers = min(max_workers or available_cores(), available_cores(), len(cases))
+    index = {case: i for i, case in enumerate(cases)}
+    aggregate = None
+    totals = np.full(len(cases), np.nan)
+    failed = {}
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=init_worker) as executor:
+        for case, consumption, error in executor.map(simulate, cases):
+            if error is not None:
+                failed[case] = error
+                continue
+            if aggregate is None:
+                aggregate = np.zeros(len(consumption))
+            elif len(consumption) != len(aggregate):
+                failed[case] = f'{len(consumption)} timesteps instead of {len(aggregate)}'
+                continue
+            aggregate += consumption
+            totals[index[case]] = consumption.sum()*TIMESTEP/3600
+    return aggregate, totals, failed
+
+
+def main():
+    '''
+    Runs the baseline of every IDF in idf/ and saves the aggregate and its MU and SIGMA.
+    '''
+    args = sys.argv[1:]
+    unknown = set(args) - {'pricing', '--partial'}
+    if unknown:
+        sys.exit(f'Unknown arguments {sorted(unknown)}, use pricing and --partial')
+    cases = sorted(fname[:-4] for fname in os.listdir('idf') if fname.endswith('.idf'))
+    aggregate, totals, failed = run_baseline(cases)
+    for case, error in failed.items():
+        print(f'{case}: {error}', file=sys.stderr)
+    if aggregate is None:
+        raise RuntimeError('All baseline simulations failed')
+    if failed and '--partial' not in args:
+        sys.exit(
+            f'{len(failed)} of {len(cases)} buildings failed, nothing written; '
+            'use --partial to calibrate on the others'
+        )
+
+    mu, sigma = aggregate.mean(), aggregate.std()
+    np.savez(
+        BASELINE_FILE, cases=np.array(cases), aggregate=aggregate, totals=totals,
+        mu=mu, sigma=sigma
+    )
+    print(
+        f'{len(cases) - len(failed)} of {len(cases)} buildings: MU = {mu:.0f}, SIGMA = {sigma:.0f}'
+    )
+
+    if 'pricing' in args:
+        with open('../input/pricing.json', 'w', encoding='utf-8') as file:
+            json.dump(
+                {'model': 'zscore', 'mu': float(mu), 'sigma': float(sigma), 'max_sigma': 2},
+                file, indent=4
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+'''
+Content-hashed build cache for the processed inputs written by process_input.py. Every artifact
+is recorded with a key hashed from the contents of its input files and the parameters it depends
+on, and is only rebuilt when that key changes or the artifact is missing.
+'''
+import os
+import json
+import inspect
+import hashlib
+
+# Size of the blocks read when hashing files
+BLOCK_SIZE = 1 << 20
+
+
+def file_hash(path):
+    '''
+    Returns the SHA-256 of the contents of a file.
+    '''
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def source_hash(*functions):
+    '''
+    Returns the SHA-256 of the source code of functions, so artifacts are rebuilt when the code
+    that builds them changes.
+    '''
+    digest = hashlib.sha256()
+    for function in functions:
+        digest.update(inspect.getsource(function).encode())
+    return digest.hexdigest()
+
+
+class BuildCache:
+    '''
+    Keys of the artifacts built by the last runs, stored as JSON in path. Input file hashes are
+    stored with the file size and modification time, and only recomputed when these change.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.artifacts = {}
+        self.inputs = {}
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as file:
+                cache = json.load(file)
+            self.artifacts = cache.get('artifacts', {})
+            self.inputs = cache.get('inputs', {})
+
+    def input_hash(self, path):
+        '''
+        Returns the hash of an input file, reusing the stored hash if the file is unchanged.
+        '''
+        stat = os.stat(path)
+        entry = self.inputs.get(path)
+        if entry is None or entry['size'] != stat.st_size or entry['mtime_ns'] != stat.st_mtime_ns:
+            entry = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': file_hash(path)}
+            self.inputs[path] = entry
+        return entry['sha256']
+
+    def key(self, input_paths, params=None):
+        '''
+        Returns the key of an artifact built from input_paths with the JSON serializable params.
+        '''
+        digest = hashlib.sha256()
+        for path in input_paths:
+            digest.update(f'{path}\0{self.input_hash(path)}\0'.encode())
+        digest.update(json.dumps(params, sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def is_fresh(self, artifact, key):
+        '''
+        Whether artifact exists and was built with key.
+        '''
+        return self.artifacts.get(artifact) == key and os.path.exists(artifact)
+
+    def update(self, artifact, key):
+        '''
+        Records that artifact was built with key.
+        '''
+        self.artifacts[artifact] = key
+
+    def save(self):
+        '''
+        Writes the cache, through a temporary file so an interrupted run leaves the old cache.
+        '''
+        with open(f'{self.path}.tmp', 'w', encoding='utf-8') as file:
+            json.dump({'artifacts': self.artifacts, 'inputs': self.inputs}, file, indent=1)
+        os.replace(f'{self.path}.tmp', self.path)
@@ -2,6 +2,9 @@
 Simulator for EnergyPlus residential building federate.
 '''
 import sys
+import csv
+from event_sync import SyncSchedule, request_time
+from profiling import StepTimer
 
 # EnergyPlus Python API
 sys.path.insert(1, "/usr/local/EnergyPlus-9-5-0")
@@ -13,20 +16,33 @@ state = api.state_manager.new_state()
 HANDLE = None
 CLG_SETP_HANDLE = None
 HTG_SETP_HANDLE = None
+OAT_HANDLE = None
+
+# Control log of every primary run period timestep, the training data of surrogate.py
+LOG_COLUMNS = ['time', 'hour', 'outdoor_temperature', 'tolerance', 'consumption']
+LOG = []
 
 # Set maximum price and temperature setpoint tolerance
 MAX_PRICE = 4
 MAX_TOLERANCE = 4
 
+# Length of a zone timestep in seconds
+TIMESTEP = 15*60
+
+# Print the wall time per timestep of EnergyPlus, HELICS and the exchange API calls at the end of
+# the run, and write it for every timestep to output/{CASE}/step_trace.csv, see profiling.py
+PROFILE = True
+TRACE = False
+
 # Helics import statement must come AFTER state declaration to circumvent bug
 import helics as h
 
 def get_handle(state):
     '''
-    Gets handle to the house's electricity meter, its cooling setpoint, and its heating setpoint.
-    Run once at the beginning of a simulation.
+    Gets handle to the house's electricity meter, its cooling setpoint, its heating setpoint, and
+    the outdoor temperature. Run once at the beginning of a simulation.
     '''
-    global HANDLE, CLG_SETP_HANDLE, HTG_SETP_HANDLE
+    global HANDLE, CLG_SETP_HANDLE, HTG_SETP_HANDLE, OAT_HANDLE
     HANDLE = api.exchange.get_meter_handle(
         state,
         "Electricity:Facility".upper(),
@@ -43,23 +59,41 @@ def get_handle(state):
         "Schedule Value",
         "heating_setpoint"
     )
+    OAT_HANDLE = api.exchange.get_variable_handle(
+        state,
+        "Site Outdoor Air Drybulb Temperature",
+        "Environment"
+    )
 
 def control_loop(state):
     '''
     Reads the price from the supplier, sets the heating and cooling temperature setpoints, and
     publishes the facility-level electricity consumption to the secondary distribution federate.
+    HELICS is only synced when the consumption changes or the sync interval has elapsed, see
+    event_sync.py; otherwise the last price is kept.
     '''
 
     # EnergyPlus API callbacks can't take parameters other than the state, so input variables have
     # to be read in as global variables
-    global t, step
+    global t, local_t, price
 
     # We only want the control loop to be active during the primary run period, not sizing or
     # warmup runs. Otherwise, the timing with the grid-side federate would be thrown off.
     if (api.exchange.kind_of_sim(state) == 3) and not api.exchange.warmup_flag(state):
-
-        # Read the price from the supplier
-        price = h.helicsInputGetDouble(sub)
+        # The time since the end of the last control loop was spent in EnergyPlus
+        timer.lap('energyplus')
+
+        # Sync, publish the consumption and read the price from the supplier
+        consumption = api.exchange.get_meter_value(state, HANDLE)/TIMESTEP
+        timer.lap('exchange')
+        if schedule.due(local_t, consumption):
+            t = request_time(fed, t, local_t)
+            h.helicsPublicationPublishComplex(
+                pub,
+                consumption
+            )
+            price = h.helicsInputGetDouble(sub)
+        timer.lap('helics')
 
         # Set the temperature setpoint actuators as a function of the price.
         tolerance = (MAX_TOLERANCE/MAX_PRICE)*price*(5/9)
@@ -74,11 +108,16 @@ def control_loop(state):
             22.22 - tolerance
         )
 
-        h.helicsPublicationPublishComplex(
-            pub,
-            (api.exchange.get_meter_value(state, HANDLE)/900)
-        )
-        t = h.helicsFederateRequestTime(fed, t+(15*60))
+        LOG.append((
+            local_t,
+            api.exchange.current_time(state),
+            api.exchange.get_variable_value(state, OAT_HANDLE),
+            tolerance,
+            consumption
+        ))
+        timer.lap('exchange')
+        timer.end_step(local_t)
+        local_t += TIMESTEP
 
 # Get case name from command line argument
 CASE = sys.argv[1]
@@ -95,10 +134,15 @@ h.helicsPublicationPublishComplex(pub, 0)
 # Schedule the callbacks - see EnergyPlus API documentation
 api.runtime.callback_end_zone_sizing(state, get_handle)
 api.runtime.callback_end_zone_timestep_after_zone_reporting(state, control_loop)
+api.exchange.request_variable(state, "SITE OUTDOOR AIR DRYBULB TEMPERATURE", "ENVIRONMENT")
 
-# Run the simulation
+# Run the simulation, local_t is the time of the EnergyPlus timestep and t the HELICS time
 h.helicsFederateEnterExecutingMode(fed)
 t = h.helicsFederateRequestTime(fed, 0)
+local_t = 0
+price = 0.0
+schedule = SyncSchedule(TIMESTEP)
+timer = StepTimer(CASE, ['energyplus', 'helics', 'exchange'])
 api.runtime.run_energyplus(
     state = state,
     command_line_args = [
@@ -108,6 +152,18 @@ api.runtime.run_energyplus(
     ]
 )
 
+print(f'{CASE}: synced {schedule.syncs} of {len(LOG)} timesteps')
+if PROFILE:
+    print(timer.summary())
+if TRACE:
+    timer.write_trace(f'output/{CASE}/step_trace.csv')
+
+# Save the control log
+with open(f'output/{CASE}/control_log.csv', 'w', encoding='utf-8', newline='') as file:
+    writer = csv.writer(file)
+    writer.writerow(LOG_COLUMNS)
+    writer.writerows(LOG)
+
 # Close Helics federate
 h.helicsFederateDisconnect(fed)
 h.helicsFederateFree(fed)
@@ -0,0 +1,266 @@
+'''
+Simulator for a cluster of EnergyPlus residential buildings behind a single HELICS federate.
+
+Each building runs in its own EnergyPlus state on a worker thread; the EnergyPlus API releases the
+GIL while EnergyPlus runs, so the buildings simulate in parallel. At every zone timestep the
+buildings report their consumption and wait on a barrier while the main thread requests the time
+from HELICS, publishes all consumptions under the same keys as the single building federates
+({case}/electricity_consumption) and reads the price; the buildings then set their setpoints from
+the price. HELICS is only synced when a consumption changes or the sync interval has elapsed, see
+event_sync.py.
+
+If a building fails or a barrier breaks while buildings are still simulating, the cluster is
+aborted: the remaining buildings stop controlling and logging (EnergyPlus 9.5 has no
+stop_simulation, so they run to the end of their run period unsynchronized) and the federate exits
+with a nonzero status.
+'''
+import sys
+import csv
+import json
+import threading
+from event_sync import SyncSchedule, request_time
+from profiling import StepTimer
+
+# EnergyPlus Python API
+sys.path.insert(1, "/usr/local/EnergyPlus-9-5-0")
+from pyenergyplus.api import EnergyPlusAPI
+
+# Instantiate EnergyPlus API, the states are created per building
+api = EnergyPlusAPI()
+
+# Set maximum price and temperature setpoint tolerance
+MAX_PRICE = 4
+MAX_TOLERANCE = 4
+
+# Length of a zone timestep in seconds
+TIMESTEP = 15*60
+
+# Print the wall time per timestep of the cluster main thread, waiting for the slowest building
+# (energyplus) and syncing with HELICS, at the end of the run, and write it for every timestep to
+# output/{CLUSTER}_step_trace.csv, see profiling.py
+PROFILE = True
+TRACE = False
+
+# Columns of the control log of every building, the training data of surrogate.py
+LOG_COLUMNS = ['time', 'hour', 'outdoor_temperature', 'tolerance', 'consumption']
+
+# Helics import statement must come AFTER the EnergyPlus API to circumvent bug
+import helics as h
+
+
+class Building:
+    '''
+    One EnergyPlus building of the cluster, with its state and handles.
+    '''
+
+    def __init__(self, case, index):
+        self.case = case
+        self.index = index
+        self.state = api.state_manager.new_state()
+        self.handle = None
+        self.clg_setp_handle = None
+        self.htg_setp_handle = None
+        self.oat_handle = None
+        self.log = []
+        api.runtime.callback_end_zone_sizing(self.state, self.get_handle)
+        api.runtime.callback_end_zone_timestep_after_zone_reporting(self.state, self.control_loop)
+        api.exchange.request_variable(
+            self.state, "SITE OUTDOOR AIR DRYBULB TEMPERATURE", "ENVIRONMENT"
+        )
+
+    def get_handle(self, state):
+        '''
+        Gets handle to the house's electricity meter, its cooling setpoint, its heating setpoint,
+        and the outdoor temperature. Run once at the beginning of a simulation.
+        '''
+        self.handle = api.exchange.get_meter_handle(
+            state,
+            "Electricity:Facility".upper(),
+        )
+        self.clg_setp_handle = api.exchange.get_actuator_handle(
+            state,
+            "Schedule:Constant",
+            "Schedule Value",
+            "cooling_setpoint"
+        )
+        self.htg_setp_handle = api.exchange.get_actuator_handle(
+            state,
+            "Schedule:Constant",
+            "Schedule Value",
+            "heating_setpoint"
+        )
+        self.oat_handle = api.exchange.get_variable_handle(
+            state,
+            "Site Outdoor Air Drybulb Temperature",
+            "Environment"
+        )
+
+    def control_loop(self, state):
+        '''
+        Reports the facility-level electricity consumption, waits for the cluster to sync with
+        HELICS and sets the heating and cooling temperature setpoints from the cluster price.
+        '''
+        # We only want the control loop to be active during the primary run period, not sizing or
+        # warmup runs. Otherwise, the timing with the grid-side federate would be thrown off.
+        if (
+            (api.exchange.kind_of_sim(state) == 3) and not api.exchange.warmup_flag(state)
+            and not aborted.is_set()
+        ):
+
+            time = local_t
+            consumption[self.index] = api.exchange.get_meter_value(state, self.handle)/TIMESTEP
+            try:
+                # All buildings have reported, then the main thread has published and read the price
+                reported.wait()
+                advanced.wait()
+            except threading.BrokenBarrierError:
+                # The cluster stopped while this building still has timesteps. stop_simulation
+                # is only available from EnergyPlus 9.6, older versions run on without control.
+                aborted.set()
+                if hasattr(api.runtime, 'stop_simulation'):
+                    api.runtime.stop_simulation(state)
+                return
+
+            # Set the temperature setpoint actuators as a function of the price.
+            tolerance = (MAX_TOLERANCE/MAX_PRICE)*price*(5/9)
+            api.exchange.set_actuator_value(
+                state,
+                self.clg_setp_handle,
+                22.22 + tolerance
+            )
+            api.exchange.set_actuator_value(
+                state,
+                self.htg_setp_handle,
+                22.22 - tolerance
+            )
+            self.log.append((
+                time,
+                api.exchange.current_time(state),
+                api.exchange.get_variable_value(state, self.oat_handle),
+                tolerance,
+                consumption[self.index]
+            ))
+
+    def run(self):
+        '''
+        Runs the EnergyPlus simulation of the building, run on a worker thread.
+        '''
+        try:
+            status = api.runtime.run_energyplus(
+                state = self.state,
+                command_line_args = [
+                    '-d', f'output/{self.case}',
+                    '-w', '../input/USA_WA_Seattle-Tacoma.Intl.AP.727930_TMY3.epw',
+                    f'idf/{self.case}.idf'
+                ]
+            )
+            if status != 0:
+                failures.append(f'EnergyPlus failed for {self.case} with status {status}')
+                aborted.set()
+            with open(
+                f'output/{self.case}/control_log.csv', 'w', encoding='utf-8', newline=''
+            ) as file:
+                writer = csv.writer(file)
+                writer.writerow(LOG_COLUMNS)
+                writer.writerows(self.log)
+        except Exception as error:
+            failures.append(f'{self.case}: {error!r}')
+            aborted.set()
+
+        # The cluster stops at the first failure, or when the last building has finished. Until
+        # then, a finished building stands in at the barriers so the others keep syncing; the
+        # barriers are only aborted once no building is still inside a control loop.
+        with finished_lock:
+            finished.append(self.case)
+            last = len(finished) == len(CASES)
+        if aborted.is_set() or last:
+            reported.abort()
+            advanced.abort()
+            return
+        while True:
+            try:
+                reported.wait()
+                advanced.wait()
+            except threading.BrokenBarrierError:
+                return
+
+
+# Get cluster name from command line argument, the buildings are the cases of its publications
+CLUSTER = sys.argv[1]
+with open(f'helics_config/{CLUSTER}.json', encoding='utf-8') as file:
+    CASES = [pub['key'].split('/')[0] for pub in json.load(file)['publications']]
+
+# Create the cluster federate, with one publication per building
+fed = h.helicsCreateValueFederateFromConfig(f'helics_config/{CLUSTER}.json')
+pubs = [h.helicsFederateGetPublicationByIndex(fed, i) for i in range(len(CASES))]
+sub = h.helicsFederateGetInputByIndex(fed, 0)
+
+# Price shared by the buildings and time of their EnergyPlus timestep, updated by the main thread
+# between the two barriers
+price = 0.0
+local_t = 0
+consumption = [0.0]*len(CASES)
+reported = threading.Barrier(len(CASES) + 1)
+advanced = threading.Barrier(len(CASES) + 1)
+
+# Set when a building fails or the barriers break before the end of a building's run period,
+# with the failures of the buildings
+aborted = threading.Event()
+failures = []
+finished = []
+finished_lock = threading.Lock()
+
+buildings = [Building(case, index) for index, case in enumerate(CASES)]
+
+# Publish initial values
+h.helicsFederateEnterInitializingMode(fed)
+for pub in pubs:
+    h.helicsPublicationPublishComplex(pub, 0)
+
+# Run the simulations
+h.helicsFederateEnterExecutingMode(fed)
+t = h.helicsFederateRequestTime(fed, 0)
+schedule = SyncSchedule(TIMESTEP)
+steps = 0
+timer = StepTimer(CLUSTER, ['energyplus', 'helics'])
+threads = [threading.Thread(target=building.run, name=building.case) for building in buildings]
+for thread in threads:
+    thread.start()
+
+while True:
+    try:
+        reported.wait()
+    except threading.BrokenBarrierError:
+        break
+    timer.lap('energyplus')
+    if schedule.due(local_t, consumption):
+        t = request_time(fed, t, local_t)
+        for pub, value in zip(pubs, consumption):
+            h.helicsPublicationPublishComplex(pub, value)
+        price = h.helicsInputGetDouble(sub)
+    timer.lap('helics')
+    timer.end_step(local_t)
+    local_t += TIMESTEP
+    steps += 1
+    try:
+        advanced.wait()
+    except threading.BrokenBarrierError:
+        break
+
+for thread in threads:
+    thread.join()
+print(f'{CLUSTER}: synced {schedule.syncs} of {steps} timesteps')
+if PROFILE:
+    print(timer.summary())
+if TRACE:
+    timer.write_trace(f'output/{CLUSTER}_step_trace.csv')
+
+# Close Helics federate
+h.helicsFederateDisconnect(fed)
+h.helicsFederateFree(fed)
+h.helicsCloseLibrary()
+
+if aborted.is_set():
+    for failure in failures:
+        print(failure, file=sys.stderr)
+    sys.exit(f'{CLUSTER}: aborted after {steps} timesteps, the results are incomplete')
@@ -0,0 +1,72 @@
+'''
+Event-driven synchronization of the building federates with HELICS.
+
+The building consumption is checked at every zone timestep, but the federate only syncs with
+HELICS (requests the time, reads the price and publishes) when a consumption changed by more than
+CONSUMPTION_TOLERANCE relative to its last published value, or when the sync interval has elapsed.
+The interval starts at one timestep and doubles at every sync without change, up to
+MAX_SYNC_INTERVAL, and goes back to one timestep after a change. Hence:
+- a published consumption is never more than CONSUMPTION_TOLERANCE off the simulated one
+- a price change is seen at most MAX_SYNC_INTERVAL seconds late, and only while the buildings are
+  idle; a price change that changes a consumption is followed at the next timestep
+CONSUMPTION_TOLERANCE = None, the default, syncs at every timestep as without event-driven
+synchronization; set it (e.g. to 0.01) to opt in.
+'''
+import numpy as np
+
+# Relative change of a consumption triggering a sync, None to sync at every timestep
+CONSUMPTION_TOLERANCE = None
+
+# Longest interval between two syncs, in seconds
+MAX_SYNC_INTERVAL = 3600
+
+# Consumptions below this value, in W, are compared in absolute terms
+MIN_CONSUMPTION = 1.0
+
+
+class SyncSchedule:
+    '''
+    Decides at which timesteps a federate of one or several buildings syncs with HELICS.
+    '''
+
+    def __init__(self, timestep, tolerance=CONSUMPTION_TOLERANCE, max_interval=MAX_SYNC_INTERVAL):
+        self.timestep = timestep
+        self.tolerance = tolerance
+        self.max_interval = max_interval
+        self.interval = timestep
+        self.next_sync = 0
+        self.published = None
+        self.syncs = 0
+
+    def due(self, time, consumption):
+        '''
+        Whether the federate syncs at time, given the consumptions of the last timestep. If so,
+        the consumptions are recorded as published.
+        '''
+        consumption = np.array(consumption, dtype=float)
+        changed = (
+            self.tolerance is None or self.published is None
+            or np.any(
+                np.abs(consumption - self.published)
+                > self.tolerance*np.maximum(np.abs(self.published), MIN_CONSUMPTION)
+            )
+        )
+        if not changed and time < self.next_sync:
+            return False
+        self.interval = self.timestep if changed else min(2*self.interval, self.max_interval)
+        self.next_sync = time + self.interval
+        self.published = consumption
+        self.syncs += 1
+        return True
+
+
+def request_time(fed, t, time):
+    '''
+    Requests time from HELICS until it is granted. Requests are granted early when the price
+    changes, the latest price is read once time is reached.
+    '''
+    # Imported here, as helics must be imported after the EnergyPlus states are created
+    import helics as h
+    while t < time:
+        t = h.helicsFederateRequestTime(fed, time)
+    return t
@@ -0,0 +1,179 @@
+'''
+Streaming text-level editor for the few IDF objects process_input.py touches. It reads an IDF
+object by object without the IDD, only parses the objects listed in FIELDS and writes every other
+object back unchanged. The IDF class mirrors the parts of the eppy IDF interface used by
+process_input.py (idfobjects, newidfobject, saveas), so the same edits run on either editor.
+'''
+
+# Fields of the editable objects, in IDD order, named as in eppy. Only the leading fields that
+# are read or written need to be listed.
+FIELDS = {
+    'RUNPERIOD': [
+        'Name', 'Begin_Month', 'Begin_Day_of_Month', 'Begin_Year', 'End_Month', 'End_Day_of_Month',
+        'End_Year', 'Day_of_Week_for_Start_Day'
+    ],
+    'SCHEDULE:FILE': ['Name', 'Schedule_Type_Limits_Name', 'File_Name'],
+    'SCHEDULE:CONSTANT': ['Name', 'Schedule_Type_Limits_Name', 'Hourly_Value'],
+    'THERMOSTATSETPOINT:DUALSETPOINT': [
+        'Name',
+        'Heating_Setpoint_Temperature_Schedule_Name',
+        'Cooling_Setpoint_Temperature_Schedule_Name'
+    ],
+}
+
+# Width of the value column when objects are written, as in EnergyPlus and eppy output
+COMMENT_COLUMN = 26
+
+
+def split_objects(lines):
+    '''
+    Groups the lines of an IDF into objects. Each object is the list of lines up to and including
+    the line where its terminating semicolon is found. Comment and blank lines before an object
+    belong to that object.
+    '''
+    block = []
+    for line in lines:
+        block.append(line)
+        if ';' in line.split('!', 1)[0]:
+            yield block
+            block = []
+    if block:
+        yield block
+
+
+def object_key(block):
+    '''
+    Returns the object type of a block as spelled in the file and the index of its first line of
+    code, or None for a block with no object.
+    '''
+    for index, line in enumerate(block):
+        code = line.split('!', 1)[0].strip()
+        if code:
+            return code.split(',', 1)[0].split(';', 1)[0].strip(), index
+    return None, len(block)
+
+
+def parse_object(block):
+    '''
+    Returns the field values and the field comments of an object, without its type.
+    '''
+    values, comments = [], []
+    token = ''
+    for line in block:
+        code, _, comment = line.rstrip('\r\n').partition('!')
+        ended = False
+        for char in code:
+            if char in ',;':
+                values.append(token.strip())
+                comments.append('')
+                token = ''
+                ended = True
+            else:
+                token += char
+        if ended and comment:
+            comments[-1] = comment[1:].strip() if comment.startswith('-') else comment.strip()
+    return values[1:], comments[1:]
+
+
+class IDFObject:
+    '''
+    An editable IDF object. Fields are read and written by their eppy name.
+    '''
+
+    def __init__(self, key, values, comments=None, type_name=None):
+        self.key = key
+        # Object type as spelled in the file
+        self.type_name = key if type_name is None else type_name
+        self.values = list(values)
+        self.comments = list(comments) if comments is not None else [''] * len(self.values)
+        self.modified = False
+
+    def _index(self, name):
+        try:
+            return FIELDS[self.key].index(name)
+        except ValueError:
+            raise KeyError(f'{name} is not an editable field of {self.key}') from None
+
+    def __getitem__(self, name):
+        index = self._index(name)
+        return self.values[index] if index < len(self.values) else ''
+
+    def __setitem__(self, name, value):
+        index = self._index(name)
+        if index >= len(self.values):
+            missing = index + 1 - len(self.values)
+            self.values.extend([''] * missing)
+            self.comments.extend([''] * missing)
+        self.values[index] = str(value)
+        self.modified = True
+
+    def to_lines(self):
+        '''
+        Writes the object with one field per line and the field name as comment.
+        '''
+        lines = [f'{self.type_name},\n']
+        for index, (value, comment) in enumerate(zip(self.values, self.comments)):
+            if not comment and index < len(FIELDS[self.key]):
+                comment = FIELDS[self.key][index].replace('_', ' ')
+            text = value + (';' if index == len(self.values) - 1 else ',')
+            padding = ' ' * max(COMMENT_COLUMN - len(text), 4)
+            lines.append(f'    {text}{padding}!- {comment}\n' if comment else f'    {text}\n')
+        return lines
+
+
+class IDF:
+    '''
+    An IDF read from a file, with its editable objects parsed.
+    '''
+
+    def __init__(self, path):
+        # Blocks are either raw lines or IDFObject
+        self.blocks = []
+        self.idfobjects = {key: [] for key in FIELDS}
+        with open(path, encoding='utf-8') as file:
+            for block in split_objects(file):
+                type_name, code_start = object_key(block)
+                key = type_name.upper() if type_name else None
+                if key in FIELDS:
+                    # Keep the comment lines before the object
+                    self.blocks.append(block[:code_start])
+                    obj = IDFObject(key, *parse_object(block[code_start:]), type_name)
+                    obj.lines = block[code_start:]
+                    self.blocks.append(obj)
+                    self.idfobjects[key].append(obj)
+                else:
+                    self.blocks.append(block)
+
+    def newidfobject(self, key):
+        '''
+        Appends a new empty object of an editable type.
+        '''
+        key = key.upper()
+        obj = IDFObject(key, [''] * len(FIELDS[key]))
+        obj.modified = True
+        self.blocks.append(['\n'])
+        self.blocks.append(obj)
+        self.idfobjects[key].append(obj)
+        return obj
+
+    def lines(self):
+        '''
+        Yields the lines of the IDF, unmodified objects are written as they were read.
+        '''
+        last = '\n'
+        for block in self.blocks:
+            if isinstance(block, IDFObject):
+                block = block.to_lines() if block.modified else block.lines
+            for line in block:
+                # Files may not end with a newline before an appended object
+                if not last.endswith('\n'):
+                    yield '\n'
+                yield line
+                last = line
+
+    def saveas(self, path):
+        '''
+        Writes the IDF to path.
+        '''
+        with open(path, 'w', encoding='utf-8') as file:
+            file.writelines(self.lines())
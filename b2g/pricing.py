@@ -0,0 +1,109 @@
+'''
+Price models of the supplier federate. A model maps the demand of every feeder to a price signal
+in the range the buildings respond to (0 to MAX_PRICE, see building.py). Models precompute their
+lookup tables when created and evaluate all feeders at once on numpy arrays.
+
+Models are created from a dict such as the content of input/pricing.json:
+    {"model": "zscore", "mu": 62992, "sigma": 13291, "max_sigma": 2}
+    {"model": "tou", "weekday": [24 prices], "weekend": [24 prices]}
+    {"model": "merit_order", "capacity": [...], "price": [...], "max_price": 4}
+The z-score mu and sigma can be lists with one value per feeder, and the TOU prices lists of 24
+lists with one value per feeder. The merit-order stack is shared by all feeders.
+The TOU week starts on the first day of the run period (see run_period.py) unless the config sets
+start_weekday.
+'''
+import numpy as np
+from run_period import start_weekday as run_period_start_weekday
+
+# Price range the buildings respond to
+MAX_PRICE = 4
+
+
+class ZScorePrice:
+    '''
+    Price from the z-score of the demand, clipped to +/- max_sigma and shifted to start at 0.
+    mu and sigma are the demand mean and standard deviation of an uncontrolled run, in W.
+    '''
+
+    def __init__(self, mu, sigma, max_sigma=2):
+        self.mu = np.asarray(mu, dtype=float)
+        self.sigma = np.asarray(sigma, dtype=float)
+        self.max_sigma = max_sigma
+
+    def price(self, t, load):
+        '''
+        Returns the price of every feeder at time t given their loads.
+        '''
+        return np.clip((load - self.mu)/self.sigma + self.max_sigma, 0, 2*self.max_sigma)
+
+
+class TOUPrice:
+    '''
+    Tiered time-of-use price, with one price per hour for weekdays and weekends. The hourly
+    prices of the whole week are tabulated once.
+    start_weekday: day of the week of the first simulated day, 0 for Monday
+    '''
+
+    def __init__(self, weekday, weekend=None, start_weekday=None):
+        if start_weekday is None:
+            raise ValueError('The TOU price needs the start day of the week of the run period')
+        weekday = np.asarray(weekday, dtype=float)
+        weekend = weekday if weekend is None else np.asarray(weekend, dtype=float)
+        if weekday.shape[0] != 24 or weekend.shape[0] != 24:
+            raise ValueError('TOU prices need one value per hour of the day')
+        days = (start_weekday + np.arange(7)) % 7
+        # (hour of the week, ) or (hour of the week, feeder) prices from the first simulated day
+        self.table = np.concatenate([weekend if day >= 5 else weekday for day in days])
+
+    def price(self, t, load):
+        '''
+        Returns the price of every feeder at time t, independent of their loads.
+        '''
+        return np.broadcast_to(self.table[int(t//3600) % len(self.table)], np.shape(load))
+
+
+class MeritOrderPrice:
+    '''
+    Merit-order supply stack: blocks of capacity (W) offered at a price are dispatched from the
+    cheapest up, and the price is the one of the last block needed to meet the demand. Demand
+    beyond the stack is priced at max_price. The cumulative capacities are tabulated once, sorted
+    by price.
+    '''
+
+    def __init__(self, capacity, price, max_price=MAX_PRICE):
+        capacity = np.asarray(capacity, dtype=float)
+        price = np.asarray(price, dtype=float)
+        if capacity.ndim != 1 or price.shape != capacity.shape:
+            raise ValueError('The merit-order stack needs one capacity and one price per block')
+        order = np.argsort(price, kind='stable')
+        self.cumulative_capacity = np.cumsum(capacity[order])
+        self.prices = np.append(price[order], max_price)
+
+    def price(self, t, load):
+        '''
+        Returns the price of every feeder at time t given their loads.
+        '''
+        return self.prices[np.searchsorted(self.cumulative_capacity, load, side='left')]
+
+
+# Price models by name
+PRICE_MODELS = {
+    'zscore': ZScorePrice,
+    'tou': TOUPrice,
+    'merit_order': MeritOrderPrice,
+}
+
+
+def create_model(config, run_period=None):
+    '''
+    Creates a price model from a dict with the model name under 'model' and its parameters. The
+    TOU week starts on the first day of run_period, a dict read by run_period.read_run_period,
+    unless config sets start_weekday.
+    '''
+    config = dict(config)
+    name = config.pop('model')
+    if name not in PRICE_MODELS:
+        raise ValueError(f'Unknown price model {name}, use one of {sorted(PRICE_MODELS)}')
+    if name == 'tou' and 'start_weekday' not in config and run_period is not None:
+        config['start_weekday'] = run_period_start_weekday(run_period)
+    return PRICE_MODELS[name](**config)
@@ -3,12 +3,50 @@ Produces processed input files from the unprocessed input files in input/
 '''
 import os
 import json
+from concurrent.futures import ProcessPoolExecutor
 import glm
 import pandas as pd
-from eppy.modeleditor import IDF
+import idf_text
+from build_cache import BuildCache, source_hash
+from run_period import write_run_period
+
+# IDF editor: 'text' edits the few objects touched here at the text level (see idf_text.py),
+# 'eppy' loads the full eppy object model
+IDF_EDITOR = 'text'
 
 # The IDD file is necessary for eppy. The versions must match.
-IDF.setiddname('input/Energy+V9_5_0.idd')
+IDD_FNAME = 'input/Energy+V9_5_0.idd'
+
+# Number of worker processes preparing the building inputs, all cores if None
+MAX_WORKERS = None
+# Number of buildings sent to a worker at once
+CHUNKSIZE = 16
+
+# Number of buildings simulated by one building_cluster.py federate, or None for one building.py
+# federate per building
+BUILDINGS_PER_CLUSTER = None
+
+# Building model: 'energyplus' runs building.py or building_cluster.py, 'surrogate' runs the
+# regressions of surrogate.py fit to the control logs of earlier EnergyPlus runs
+BUILDING_MODEL = 'energyplus'
+
+# HELICS period of the secondary GridLAB-D federate in seconds, None keeps the period of
+# input/secondary.json (1 s). The buildings exchange values every 900 s and the supplier every
+# 300 s, so a 300 s period only moves GridLAB-D's internal events by less than 300 s while
+# skipping the syncs in between. Use it with event-driven synchronization, see event_sync.py.
+SECONDARY_PERIOD = None
+
+# Record every publication of the federation (building consumptions, supplier prices, secondary
+# demands) in one Parquet file with the recorder.py federate, which needs pyarrow
+RECORD = False
+
+# Build cache of the processed inputs, see build_cache.py. Only artifacts whose inputs, parameters
+# or building code changed are rebuilt, unless REBUILD is set. The keys include the source of the
+# functions below that build each artifact, idf_text.py or the IDD of the IDF editor, and
+# BUILD_VERSION, which can be bumped to force a rebuild after other code changes.
+BUILD_CACHE = 'build_cache.json'
+BUILD_VERSION = 1
+REBUILD = False
 
 # The filename for the top-level secondary GridLAB-D model found in /input, consistant with
 # its name in the gridlabd/Taxonomy_Feeders repository.
@@ -30,119 +68,25 @@ SIM_DIRS = [
     'helics'
 ]
 
-# Create necessary directories
-for directory in SIM_DIRS:
-    if not os.path.exists(directory):
-        os.makedirs(directory)
-
-# Load JSON/GLM input files
-with open('input/building_config.json', encoding='utf-8') as file:
-    building_config = json.load(file)
-
-with open('input/secondary.json', encoding='utf-8') as file:
-    secondary = json.load(file)
-
-with open('input/subscription.json', encoding='utf-8') as file:
-    subscription = json.load(file)
-info = json.loads(subscription['info'])
-
-with open('input/run.json', encoding='utf-8') as file:
-    run = json.load(file)
-
-with open('input/federate.json', encoding='utf-8') as file:
-    federate = json.load(file)
-
-gld = glm.load(f'input/{GRIDLABD_FNAME}')
-
-# Add the 'connection' model to the GLM file. This module contains the 'helics_msg' object
-# necessary for HELICS integration
-gld['modules'].append(
-    {
-        'name': 'connection',
-        'attributes': {}
-    }
-)
-
-# Set the run period for GridLAB-D
-gld['clock']['starttime'] = f'2000-{BEGIN_MONTH}-{BEGIN_DAY} 00:00:00'
-gld['clock']['stoptime'] = f'2000-{END_MONTH}-{END_DAY} 00:00:00'
-
-# Add a 'helics_msg' object to the GLM pointing to the HELICS configuration file for the
-# secondary federate.
-gld['objects'].append(
-    {
-        'name': 'helics_msg',
-        'attributes': {
-            'name': 'secondary',
-            'configure': 'secondary.json'
-        },
-        'children': []
-    }
-)
-
-# Make two modifications to the GLM objects:
-# 1. Point the climate object to the weather file
-# 2. Replace 'house' objects with 'triplex_load' objects, keeping the same name and parent
-for gld_obj in gld['objects']:
-    if gld_obj['name'] == 'climate':
-        gld_obj['attributes']['tmyfile'] = '../input/CA-Sacramento.tmy2'
-    elif gld_obj['name'] == 'house':
-        gld_obj['name'] = 'triplex_load'
-        gld_obj['attributes'] = {
-            key: value for key, value in gld_obj['attributes'].items()
-            if key in ['name', 'parent']
-        }
-        gld_obj['children'] = []
-    elif gld_obj['name'] == 'solar':
-        gld_obj['attributes'] = {
-            key: value for key, value in gld_obj['attributes'].items()
-            if key in ['name','parent','panel_type','efficiency','area']
-        }
-
-# Modify two predefined output recorder objects:
-# 1. Voltage output: real and imaginary parts of all 10 buildings
-# 2. Power output: real power consumption of all 10 buildings plus the distribution transformer
-triplex_loads = [obj['attributes'] for obj in gld['objects'] if obj['name'] == 'triplex_load']
-for gld_obj in gld['objects']:
-    if gld_obj['name'] == 'multi_recorder':
-        if gld_obj['attributes']['file'] == 'Volt_log.csv':
-            gld_obj['attributes']['property'] = ','.join(
-                [
-                    f"{load['parent']}:measured_voltage_1.real,"
-                    + f"{load['parent']}:measured_voltage_1.imag"
-                    for load in triplex_loads
-                ]
-            )
-        elif gld_obj['attributes']['file'] == 'power_log.csv':
-            gld_obj['attributes']['property'] = ','.join(
-                ['N2:measured_real_power'] + [
-                    f"{load['parent']}:measured_real_power"
-                    for load in triplex_loads
-                ]
-            )
-        gld_obj['attributes'].pop('limit')
-
-# Delete the house output, as we have replaced the GridLAB-D houses with external EnergyPlus
-# models.
-gld['objects'] = [
-    obj for obj in gld['objects']
-    if (obj['name'] != 'multi_recorder') or (obj['attributes']['file'] != 'House_log.csv')
-]
-
-# Hard-code bldg_hvac_operation_sch to 1 all the time
-for fname in os.listdir('input/schedules'):
-    df = pd.read_csv(f'input/schedules/{fname}', index_col = 0)
-    df['bldg_hvac_operation_sch'] = 1
-    df.to_csv(f'energyplus/schedules/{fname}')
-
-
-house = [load['name'] for load in triplex_loads]
-for fname in os.listdir('input/idf'):
-    case = fname.replace('.idf','')
-
-    # Load IDF
-    idf = IDF(f'input/idf/{case}.idf')
-
+# IDF class of the editor, set in each worker by init_worker
+IDF = None
+
+def init_worker(editor):
+    '''
+    Selects the IDF editor of a worker process. With eppy, the IDD is parsed by the first IDF the
+    worker loads and reused for the following ones.
+    '''
+    global IDF
+    if editor == 'eppy':
+        from eppy.modeleditor import IDF
+        IDF.setiddname(IDD_FNAME)
+    else:
+        IDF = idf_text.IDF
+
+def edit_idf(idf, case):
+    '''
+    Sets the run period, the schedule files and the setpoint schedules of a building IDF.
+    '''
     # Set EnergyPlus run period
     run_period = [
         run_period for run_period in idf.idfobjects['RUNPERIOD']
@@ -178,32 +122,304 @@ for fname in os.listdir('input/idf'):
     setpoint['Heating_Setpoint_Temperature_Schedule_Name'] = 'heating_setpoint'
     setpoint['Cooling_Setpoint_Temperature_Schedule_Name'] = 'cooling_setpoint'
 
-    # Save modified IDF
+def prepare_idf(fname):
+    '''
+    Edits input/idf/fname and saves it to energyplus/idf. Run in the worker processes.
+    '''
+    idf = IDF(f'input/idf/{fname}')
+    edit_idf(idf, fname.replace('.idf',''))
     idf.saveas(f'energyplus/idf/{fname}')
 
-    # Create the building HELICS federate configuration file
-    building_config['name'] = case
-    with open(f'energyplus/helics_config/{case}.json', 'w', encoding='utf-8') as file:
-        json.dump(building_config, file, indent=4)
+def prepare_schedule(fname):
+    '''
+    Hard-codes bldg_hvac_operation_sch to 1 all the time. Run in the worker processes.
+    '''
+    df = pd.read_csv(f'input/schedules/{fname}', index_col = 0)
+    df['bldg_hvac_operation_sch'] = 1
+    df.to_csv(f'energyplus/schedules/{fname}')
+
+def prepare_glm():
+    '''
+    Loads the secondary GridLAB-D model and adapts it to the HELICS co-simulation. Returns the
+    model and the attributes of its triplex_load objects.
+    '''
+    gld = glm.load(f'input/{GRIDLABD_FNAME}')
+
+    # Add the 'connection' model to the GLM file. This module contains the 'helics_msg' object
+    # necessary for HELICS integration
+    gld['modules'].append(
+        {
+            'name': 'connection',
+            'attributes': {}
+        }
+    )
+
+    # Set the run period for GridLAB-D
+    gld['clock']['starttime'] = f'2000-{BEGIN_MONTH}-{BEGIN_DAY} 00:00:00'
+    gld['clock']['stoptime'] = f'2000-{END_MONTH}-{END_DAY} 00:00:00'
+
+    # Add a 'helics_msg' object to the GLM pointing to the HELICS configuration file for the
+    # secondary federate.
+    gld['objects'].append(
+        {
+            'name': 'helics_msg',
+            'attributes': {
+                'name': 'secondary',
+                'configure': 'secondary.json'
+            },
+            'children': []
+        }
+    )
+
+    # Make two modifications to the GLM objects:
+    # 1. Point the climate object to the weather file
+    # 2. Replace 'house' objects with 'triplex_load' objects, keeping the same name and parent
+    for gld_obj in gld['objects']:
+        if gld_obj['name'] == 'climate':
+            gld_obj['attributes']['tmyfile'] = '../input/CA-Sacramento.tmy2'
+        elif gld_obj['name'] == 'house':
+            gld_obj['name'] = 'triplex_load'
+            gld_obj['attributes'] = {
+                key: value for key, value in gld_obj['attributes'].items()
+                if key in ['name', 'parent']
+            }
+            gld_obj['children'] = []
+        elif gld_obj['name'] == 'solar':
+            gld_obj['attributes'] = {
+                key: value for key, value in gld_obj['attributes'].items()
+                if key in ['name','parent','panel_type','efficiency','area']
+            }
+
+    # Modify two predefined output recorder objects:
+    # 1. Voltage output: real and imaginary parts of all 10 buildings
+    # 2. Power output: real power consumption of all 10 buildings plus the distribution transformer
+    triplex_loads = [obj['attributes'] for obj in gld['objects'] if obj['name'] == 'triplex_load']
+    for gld_obj in gld['objects']:
+        if gld_obj['name'] == 'multi_recorder':
+            if gld_obj['attributes']['file'] == 'Volt_log.csv':
+                gld_obj['attributes']['property'] = ','.join(
+                    [
+                        f"{load['parent']}:measured_voltage_1.real,"
+                        + f"{load['parent']}:measured_voltage_1.imag"
+                        for load in triplex_loads
+                    ]
+                )
+            elif gld_obj['attributes']['file'] == 'power_log.csv':
+                gld_obj['attributes']['property'] = ','.join(
+                    ['N2:measured_real_power'] + [
+                        f"{load['parent']}:measured_real_power"
+                        for load in triplex_loads
+                    ]
+                )
+            gld_obj['attributes'].pop('limit')
+
+    # Delete the house output, as we have replaced the GridLAB-D houses with external EnergyPlus
+    # models.
+    gld['objects'] = [
+        obj for obj in gld['objects']
+        if (obj['name'] != 'multi_recorder') or (obj['attributes']['file'] != 'House_log.csv')
+    ]
+    return gld, triplex_loads
+
+def main():
+    '''
+    Writes the processed GridLAB-D, EnergyPlus and HELICS inputs.
+    '''
+    # Create necessary directories
+    for directory in SIM_DIRS:
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    cache = BuildCache(BUILD_CACHE)
+    if REBUILD:
+        cache.artifacts = {}
+    run_period = [BEGIN_MONTH, BEGIN_DAY, END_MONTH, END_DAY]
+
+    # Find the stale schedules and IDFs. The sorted IDF names decide the build key, the clusters,
+    # the triplex load of every building and the IDF the start day of the week is read from.
+    idf_fnames = sorted(os.listdir('input/idf'))
+    schedule_source = source_hash(prepare_schedule)
+    schedule_keys = {
+        fname: cache.key(
+            [f'input/schedules/{fname}'], {'version': BUILD_VERSION, 'source': schedule_source}
+        )
+        for fname in sorted(os.listdir('input/schedules'))
+    }
+    idf_source = source_hash(edit_idf, prepare_idf, init_worker)
+    editor_inputs = ['idf_text.py'] if IDF_EDITOR == 'text' else [IDD_FNAME]
+    idf_keys = {
+        fname: cache.key(
+            [f'input/idf/{fname}'] + editor_inputs,
+            {
+                'version': BUILD_VERSION, 'run_period': run_period, 'editor': IDF_EDITOR,
+                'source': idf_source
+            }
+        )
+        for fname in idf_fnames
+    }
+    stale_schedules = [
+        fname for fname, key in schedule_keys.items()
+        if not cache.is_fresh(f'energyplus/schedules/{fname}', key)
+    ]
+    stale_idfs = [
+        fname for fname, key in idf_keys.items()
+        if not cache.is_fresh(f'energyplus/idf/{fname}', key)
+    ]
+
+    # Edit the stale schedules and IDFs in parallel
+    if stale_schedules or stale_idfs:
+        with ProcessPoolExecutor(MAX_WORKERS, initializer=init_worker, initargs=(IDF_EDITOR,)) as executor:
+            list(executor.map(prepare_schedule, stale_schedules, chunksize=CHUNKSIZE))
+            list(executor.map(prepare_idf, stale_idfs, chunksize=CHUNKSIZE))
+    for fname in stale_schedules:
+        cache.update(f'energyplus/schedules/{fname}', schedule_keys[fname])
+    for fname in stale_idfs:
+        cache.update(f'energyplus/idf/{fname}', idf_keys[fname])
+    print(
+        f'Rebuilt {len(stale_schedules)}/{len(schedule_keys)} schedules and '
+        f'{len(stale_idfs)}/{len(idf_keys)} IDFs'
+    )
+
+    # The GLM and HELICS configurations depend on the configuration inputs and the building list
+    cases = [fname.replace('.idf','') for fname in idf_fnames]
+    if BUILDINGS_PER_CLUSTER is None:
+        federates = cases
+    else:
+        clusters = [
+            cases[start:start + BUILDINGS_PER_CLUSTER]
+            for start in range(0, len(cases), BUILDINGS_PER_CLUSTER)
+        ]
+        federates = [f'cluster_{index}' for index in range(len(clusters))]
+    # Day of the week of the run period start, shared by all the building IDFs
+    start_weekday = idf_text.IDF(
+        f'input/idf/{idf_fnames[0]}'
+    ).idfobjects['RUNPERIOD'][0]['Day_of_Week_for_Start_Day']
+    config_artifacts = [
+        f'gridlab-d/{GRIDLABD_FNAME}', 'gridlab-d/secondary.json', 'helics/run.json',
+        'energyplus/run_period.json'
+    ] + [f'energyplus/helics_config/{name}.json' for name in federates]
+    if RECORD:
+        config_artifacts.append('helics/recorder.json')
+    config_key = cache.key(
+        [
+            f'input/{GRIDLABD_FNAME}', 'input/building_config.json', 'input/secondary.json',
+            'input/subscription.json', 'input/run.json', 'input/federate.json', 'run_period.py'
+        ] + (['input/supplier.json'] if RECORD else []),
+        {
+            'version': BUILD_VERSION, 'run_period': run_period, 'start_weekday': start_weekday,
+            'buildings': idf_fnames,
+            'buildings_per_cluster': BUILDINGS_PER_CLUSTER, 'building_model': BUILDING_MODEL,
+            'secondary_period': SECONDARY_PERIOD, 'record': RECORD,
+            'source': source_hash(prepare_glm, main)
+        }
+    )
+    if all(cache.is_fresh(artifact, config_key) for artifact in config_artifacts):
+        cache.save()
+        return
+
+    # Load JSON input files
+    with open('input/building_config.json', encoding='utf-8') as file:
+        building_config = json.load(file)
+
+    with open('input/secondary.json', encoding='utf-8') as file:
+        secondary = json.load(file)
+    if SECONDARY_PERIOD is not None:
+        secondary['period'] = SECONDARY_PERIOD
+
+    with open('input/subscription.json', encoding='utf-8') as file:
+        subscription = json.load(file)
+    info = json.loads(subscription['info'])
+
+    with open('input/run.json', encoding='utf-8') as file:
+        run = json.load(file)
+
+    with open('input/federate.json', encoding='utf-8') as file:
+        federate = json.load(file)
+
+    gld, triplex_loads = prepare_glm()
+
+    house = [load['name'] for load in triplex_loads]
+    for case in cases:
+        # Create the building HELICS federate configuration file
+        if BUILDINGS_PER_CLUSTER is None:
+            building_config['name'] = case
+            with open(f'energyplus/helics_config/{case}.json', 'w', encoding='utf-8') as file:
+                json.dump(building_config, file, indent=4)
+
+        # Add the building subscription to the secondary HELICS configuration file
+        info['object'] = house.pop(0)
+        subscription['key'] = f'{case}/electricity_consumption'
+        subscription['info'] = json.dumps(info)
+        secondary['subscriptions'].append(subscription.copy())
+
+        # Add the building federate to the HELICS CLI configuration file
+        if BUILDINGS_PER_CLUSTER is None:
+            federate['exec'] = (
+                f'python ../building.py {case}' if BUILDING_MODEL == 'energyplus'
+                else f'python ../surrogate.py {case}'
+            )
+            federate['name'] = case
+            run['federates'].append(federate.copy())
+
+    # Create the cluster HELICS federate configuration files, with one global publication per
+    # building so the secondary subscriptions are the same as with one federate per building
+    if BUILDINGS_PER_CLUSTER is not None:
+        publication = building_config['publications'][0]
+        for name, cluster in zip(federates, clusters):
+            cluster_config = dict(building_config, name=name)
+            cluster_config['publications'] = [
+                dict(publication, key=f"{case}/{publication['key']}", **{'global': True})
+                for case in cluster
+            ]
+            with open(f'energyplus/helics_config/{name}.json', 'w', encoding='utf-8') as file:
+                json.dump(cluster_config, file, indent=4)
+
+            federate['exec'] = (
+                f'python ../building_cluster.py {name}' if BUILDING_MODEL == 'energyplus'
+                else f'python ../surrogate.py {name}'
+            )
+            federate['name'] = name
+            run['federates'].append(federate.copy())
+
+    # Create the recorder HELICS configuration file, subscribing to the publications of all
+    # federates, and add the recorder to the HELICS CLI configuration file
+    if RECORD:
+        with open('input/supplier.json', encoding='utf-8') as file:
+            supplier = json.load(file)
+        recorder = {
+            'name': 'recorder',
+            'loglevel': 'warning',
+            'subscriptions': [
+                {'key': f'{case}/electricity_consumption', 'type': 'double'} for case in cases
+            ] + [
+                {'key': f"{config['name']}/{publication['key']}", 'type': 'double'}
+                for config in (supplier, secondary) for publication in config['publications']
+            ]
+        }
+        with open('helics/recorder.json', 'w', encoding='utf-8') as file:
+            json.dump(recorder, file, indent=4)
+        run['federates'].append({
+            'directory': '..', 'exec': 'python recorder.py', 'host': 'localhost',
+            'name': 'recorder'
+        })
+
+    # Create the secondary GLM file, secondary HELICS configuration file, and HELICS CLI
+    # configuration file
+    with open(f'gridlab-d/{GRIDLABD_FNAME}', 'w', encoding='utf-8') as file:
+        file.write(glm.dumps(gld).replace('"', "'", 4))
 
-    # Add the building subscription to the secondary HELICS configuration file
-    info['object'] = house.pop(0)
-    subscription['key'] = f'{case}/electricity_consumption'
-    subscription['info'] = json.dumps(info)
-    secondary['subscriptions'].append(subscription.copy())
+    with open('gridlab-d/secondary.json', 'w', encoding='utf-8') as file:
+        json.dump(secondary, file, indent=4)
 
-    # Add the building federate to the HELICS CLI configuration file
-    federate['exec'] = f'python ../building.py {case}'
-    federate['name'] = case
-    run['federates'].append(federate.copy())
+    with open('helics/run.json', 'w', encoding='utf-8') as file:
+        json.dump(run, file, indent=4)
 
-# Create the secondary GLM file, secondary HELICS configuration file, and HELICS CLI
-# configuration file
-with open(f'gridlab-d/{GRIDLABD_FNAME}', 'w', encoding='utf-8') as file:
-    file.write(glm.dumps(gld).replace('"', "'", 4))
+    # Write the run period for the federates that do not run EnergyPlus
+    write_run_period('energyplus/run_period.json', *run_period, start_weekday)
 
-with open('gridlab-d/secondary.json', 'w', encoding='utf-8') as file:
-    json.dump(secondary, file, indent=4)
+    for artifact in config_artifacts:
+        cache.update(artifact, config_key)
+    cache.save()
 
-with open('helics/run.json', 'w', encoding='utf-8') as file:
-    json.dump(run, file, indent=4)
+if __name__ == '__main__':
+    main()
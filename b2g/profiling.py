@@ -0,0 +1,95 @@
+'''
+Low-overhead per-timestep profiling of the federate hot paths.
+
+A StepTimer splits the wall time of every timestep into named phases: each call to lap charges
+the time elapsed since the previous call to a phase, so instrumenting a loop costs one
+perf_counter call per phase boundary. At the end of the run, summary returns the distribution of
+the time per timestep of every phase as a histogram with decade bins, and the per-timestep
+durations can be written to a trace file to find straggler federates, e.g. by concatenating the
+traces of all buildings with pandas.
+'''
+import time
+import numpy as np
+
+# Upper edges of the histogram bins of the summary, in seconds
+BIN_EDGES = [1e-5, 1e-4, 1e-3, 1e-2, 1e-1, 1.0, np.inf]
+BIN_LABELS = ['<10us', '<100us', '<1ms', '<10ms', '<100ms', '<1s', '>=1s']
+
+
+class StepTimer:
+    '''
+    Wall time per timestep of the given phases of a federate.
+    '''
+
+    def __init__(self, name, phases):
+        self.name = name
+        self.phases = list(phases)
+        self.index = {phase: i for i, phase in enumerate(self.phases)}
+        self.current = [0.0]*len(self.phases)
+        self.times = []
+        self.steps = []
+        self.last = None
+
+    def lap(self, phase):
+        '''
+        Charges the time elapsed since the previous lap to phase. The first lap only starts the
+        timer.
+        '''
+        now = time.perf_counter()
+        if self.last is not None:
+            self.current[self.index[phase]] += now - self.last
+        self.last = now
+
+    def end_step(self, step_time):
+        '''
+        Records the phase durations of the timestep at step_time (simulation seconds).
+        '''
+        self.times.append(step_time)
+        self.steps.append(self.current)
+        self.current = [0.0]*len(self.phases)
+
+    def durations(self):
+        '''
+        Returns the (timesteps, phases) durations in seconds.
+        '''
+        return np.array(self.steps).reshape(len(self.steps), len(self.phases))
+
+    def summary(self):
+        '''
+        Returns a text summary with the total, percentiles and histogram of every phase.
+        '''
+        durations = self.durations()
+        lines = [f'{self.name}: {len(durations)} timesteps, {durations.sum():.2f} s']
+        columns = ['total s', 'mean ms', 'p50 ms', 'p99 ms', 'max ms']
+        lines.append(
+            f"{'phase':>12} " + ' '.join(f'{column:>9}' for column in columns) + '  '
+            + ' '.join(f'{label:>7}' for label in BIN_LABELS)
+        )
+        for i, phase in enumerate(self.phases):
+            phase_durations = durations[:, i]
+            if len(phase_durations):
+                p50, p99 = np.percentile(phase_durations, [50, 99])*1e3
+                mean, peak = phase_durations.mean()*1e3, phase_durations.max()*1e3
+            else:
+                p50 = p99 = mean = peak = 0.0
+            counts = np.bincount(
+                np.searchsorted(BIN_EDGES, phase_durations, side='right'),
+                minlength=len(BIN_EDGES)
+            )
+            lines.append(
+                f'{phase:>12} {phase_durations.sum():9.2f} {mean:9.3f} {p50:9.3f} {p99:9.3f} '
+                f'{peak:9.3f}  ' + ' '.join(f'{count:7d}' for count in counts)
+            )
+        return '\n'.join(lines)
+
+    def write_trace(self, path):
+        '''
+        Writes the durations of every timestep as a CSV file with a time column and one column per
+        phase, in seconds.
+        '''
+        durations = self.durations()
+        table = np.column_stack([np.array(self.times, dtype=float), durations])
+        np.savetxt(
+            path, table, delimiter=',', header=','.join(['time'] + self.phases),
+            comments='', fmt='%.9g'
+        )
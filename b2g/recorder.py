@@ -0,0 +1,127 @@
+'''
+Recorder federate for the results of a b2g co-simulation. The recorder subscribes to every
+publication of the federation (the building consumptions, the supplier prices and the secondary
+demands), listed in helics/recorder.json by process_input.py, and streams them into a single
+Parquet file with one column per key and one row per time at which a value was updated.
+
+Rows are buffered in memory and written CHUNK_ROWS at a time as compressed row groups, so the
+memory use does not grow with the length of the run. The recorder only requests the end of the
+simulation, so it is woken by HELICS when a value is published and never holds the others back.
+
+Read the results with read_results, e.g. in analysis.ipynb:
+    from recorder import read_results
+    results = read_results('results.parquet', keys=['supplier/price'])
+'''
+import sys
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# HELICS configuration written by process_input.py and results file
+CONFIG_FILE = 'helics/recorder.json'
+RESULTS_FILE = 'results.parquet'
+
+# Number of rows buffered before they are written as a row group, compression and type of the
+# recorded values
+CHUNK_ROWS = 4096
+COMPRESSION = 'zstd'
+VALUE_DTYPE = np.float32
+
+# Name of the time column, in seconds from the start of the simulation
+TIME_COLUMN = 'time'
+
+
+class ResultWriter:
+    '''
+    Buffers rows of values of the given keys and writes them as row groups of a Parquet file.
+    A row recorded at the same time as the previous one replaces it, so every time has the last
+    values published at that time.
+    '''
+
+    def __init__(self, path, keys, chunk_rows=CHUNK_ROWS, compression=COMPRESSION):
+        self.keys = list(keys)
+        self.schema = pa.schema(
+            [(TIME_COLUMN, pa.float64())]
+            + [(key, pa.from_numpy_dtype(VALUE_DTYPE)) for key in self.keys]
+        )
+        self.writer = pq.ParquetWriter(path, self.schema, compression=compression)
+        self.times = np.empty(chunk_rows)
+        self.values = np.empty((chunk_rows, len(self.keys)), dtype=VALUE_DTYPE)
+        self.rows = 0
+        self.written = 0
+
+    def record(self, time, values):
+        '''
+        Adds a row of values at time.
+        '''
+        if self.rows and self.times[self.rows - 1] == time:
+            self.values[self.rows - 1] = values
+            return
+        if self.rows == len(self.times):
+            self.flush()
+        self.times[self.rows] = time
+        self.values[self.rows] = values
+        self.rows += 1
+
+    def flush(self):
+        '''
+        Writes the buffered rows as a row group.
+        '''
+        if not self.rows:
+            return
+        columns = [pa.array(self.times[:self.rows])] + [
+            pa.array(self.values[:self.rows, i]) for i in range(len(self.keys))
+        ]
+        self.writer.write_table(pa.Table.from_arrays(columns, schema=self.schema))
+        self.written += self.rows
+        self.rows = 0
+
+    def close(self):
+        '''
+        Writes the remaining rows and closes the file.
+        '''
+        self.flush()
+        self.writer.close()
+
+
+def read_results(path=RESULTS_FILE, keys=None):
+    '''
+    Reads the recorded values of keys, all keys if None, as a DataFrame indexed by time.
+    Only the requested columns are read from the file.
+    '''
+    columns = None if keys is None else [TIME_COLUMN] + list(keys)
+    return pq.read_table(path, columns=columns).to_pandas().set_index(TIME_COLUMN)
+
+
+def run(config_file=CONFIG_FILE, results_file=RESULTS_FILE):
+    '''
+    Records every subscription of config_file until the end of the simulation.
+    '''
+    import helics as h
+
+    fed = h.helicsCreateValueFederateFromConfig(config_file)
+    n_subs = h.helicsFederateGetInputCount(fed)
+    subs = [h.helicsFederateGetInputByIndex(fed, i) for i in range(n_subs)]
+    keys = [h.helicsInputGetTarget(sub) for sub in subs]
+    writer = ResultWriter(results_file, keys)
+    values = np.zeros(len(subs), dtype=VALUE_DTYPE)
+
+    h.helicsFederateEnterExecutingMode(fed)
+    t = h.helicsFederateRequestTime(fed, h.HELICS_TIME_MAXTIME)
+    while t < h.HELICS_TIME_MAXTIME:
+        for i, sub in enumerate(subs):
+            if h.helicsInputIsUpdated(sub):
+                values[i] = h.helicsInputGetDouble(sub)
+        writer.record(t, values)
+        t = h.helicsFederateRequestTime(fed, h.HELICS_TIME_MAXTIME)
+    writer.close()
+    print(f'recorder: {writer.written} rows of {len(keys)} keys written to {results_file}')
+
+    # Close Helics federate
+    h.helicsFederateDisconnect(fed)
+    h.helicsFederateFree(fed)
+    h.helicsCloseLibrary()
+
+
+if __name__ == '__main__':
+    run(*sys.argv[1:])
@@ -0,0 +1,67 @@
+'''
+Run period of the simulations, written by process_input.py to energyplus/run_period.json so the
+federates that do not run EnergyPlus (surrogate.py, supplier.py) follow the same calendar as the
+EnergyPlus run period of the buildings.
+'''
+import json
+import datetime
+
+# Days of the week, as in the Day of Week for Start Day field of the EnergyPlus RunPeriod
+WEEKDAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+# Start day used by EnergyPlus when the RunPeriod has none
+DEFAULT_START_WEEKDAY = 'Sunday'
+
+# Year without leap day, as the typical meteorological year weather files
+WEATHER_YEAR = 2001
+
+
+def write_run_period(path, begin_month, begin_day, end_month, end_day, start_weekday):
+    '''
+    Writes the run period to path as JSON.
+    '''
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump({
+            'begin_month': begin_month, 'begin_day': begin_day,
+            'end_month': end_month, 'end_day': end_day,
+            'start_weekday': start_weekday or DEFAULT_START_WEEKDAY
+        }, file, indent=4)
+
+
+def read_run_period(path):
+    '''
+    Reads a run period written by write_run_period.
+    '''
+    with open(path, encoding='utf-8') as file:
+        return json.load(file)
+
+
+def day_of_year(month, day):
+    '''
+    Returns the day of the year, from 1, of a date of the weather file year.
+    '''
+    return datetime.date(WEATHER_YEAR, month, day).timetuple().tm_yday
+
+
+def start_day_of_year(run_period):
+    '''
+    Returns the day of the year, from 1, of the first day of the run period.
+    '''
+    return day_of_year(run_period['begin_month'], run_period['begin_day'])
+
+
+def number_of_days(run_period):
+    '''
+    Returns the number of days of the run period, which wraps around the end of the year if it
+    ends before it begins.
+    '''
+    begin = start_day_of_year(run_period)
+    end = day_of_year(run_period['end_month'], run_period['end_day'])
+    return (end - begin) % 365 + 1
+
+
+def start_weekday(run_period):
+    '''
+    Returns the day of the week of the first day of the run period, 0 for Monday.
+    '''
+    return WEEKDAYS.index(run_period['start_weekday'].capitalize())
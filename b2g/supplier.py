@@ -1,12 +1,20 @@
 '''
-Simulator for the supplier federate. The supplier subscribes to the secondary distribution
-circuit's load and uses a simple supply curve function to generate a price.
+Simulator for the supplier federate. The supplier subscribes to the load of one or several
+secondary distribution circuits (feeders or substations) and uses a price model of pricing.py to
+generate one price per circuit. The subscriptions and publications of input/supplier.json are
+paired by index: the price of the circuit of subscription i is published on publication i.
 '''
+import os
+import json
+import numpy as np
 import helics as h
-import pandas as pd
+from pricing import create_model
+from run_period import read_run_period
+from profiling import StepTimer
 
 # Mean and standard deviation come from a run with a constant tolerance of 2 degrees Farenheit
 # For analaysis, run stored in ./uncontrolled.csv
+# They can be recomputed for other buildings without HELICS with baseline.py
 MU = 62992
 SIGMA = 13291
 
@@ -14,36 +22,83 @@ SIGMA = 13291
 # clipped to those values
 MAX_SIGMA = 2
 
+# Price model, see pricing.py. The z-score model with the values above is used when the file
+# does not exist. The TOU week starts on the first day of the run period written by
+# process_input.py.
+PRICE_CONFIG = 'input/pricing.json'
+RUN_PERIOD_FILE = 'energyplus/run_period.json'
+
 # Number of seconds to run the simulation for
 MAX_T = 60*60*24*31
 
-# Create federate and get publication (price) and subscription (demand)
+# Event-driven synchronization: the price is only published when it moves by more than
+# PRICE_DEADBAND from the last published price, and the supplier requests the end of the
+# simulation, so it is only woken when the demand is updated (at multiples of its 300 s period).
+# With EVENT_DRIVEN set to False, the default, the supplier polls every 300 s and publishes every
+# price. Use it with CONSUMPTION_TOLERANCE in event_sync.py.
+EVENT_DRIVEN = False
+PRICE_DEADBAND = 0.01
+
+# Print the wall time per step of HELICS, the input and output calls and the price model at the
+# end of the run, and write it for every step to supplier_trace.csv, see profiling.py
+PROFILE = True
+TRACE = False
+
+# Create the price model, its lookup tables are computed once here
+if os.path.exists(PRICE_CONFIG):
+    with open(PRICE_CONFIG, encoding='utf-8') as file:
+        price_config = json.load(file)
+    run_period = read_run_period(RUN_PERIOD_FILE) if os.path.exists(RUN_PERIOD_FILE) else None
+    model = create_model(price_config, run_period)
+else:
+    model = create_model({'model': 'zscore', 'mu': MU, 'sigma': SIGMA, 'max_sigma': MAX_SIGMA})
+
+# Create federate and get publications (prices) and subscriptions (demands), one per circuit
 fed = h.helicsCreateValueFederateFromConfig('input/supplier.json')
-pub = h.helicsFederateGetPublicationByIndex(fed, 0)
-sub = h.helicsFederateGetInputByIndex(fed, 0)
+n_circuits = h.helicsFederateGetInputCount(fed)
+if h.helicsFederateGetPublicationCount(fed) != n_circuits:
+    raise ValueError('input/supplier.json needs one price publication per demand subscription')
+pubs = [h.helicsFederateGetPublicationByIndex(fed, i) for i in range(n_circuits)]
+subs = [h.helicsFederateGetInputByIndex(fed, i) for i in range(n_circuits)]
 
 # Initialize the federate and publish initial value; shouldn't matter what it is
 h.helicsFederateEnterInitializingMode(fed)
-h.helicsPublicationPublishComplex(pub, MAX_SIGMA)
+for pub in pubs:
+    h.helicsPublicationPublishComplex(pub, MAX_SIGMA)
 
 h.helicsFederateEnterExecutingMode(fed)
 
 t = 0
+load = np.zeros(n_circuits)
+published_price = np.full(n_circuits, np.nan)
+updates = 0
+timer = StepTimer('supplier', ['helics', 'exchange', 'pricing'])
+timer.lap('helics')
 while t < MAX_T:
-    # Control loop: read transformer load, compute z-score, publish price
-    load = h.helicsInputGetDouble(sub)
-    z_score = (load-MU)/SIGMA
-    price = z_score + MAX_SIGMA
-    price = (
-        0 if price < 0
-        else 2*MAX_SIGMA if price > 2*MAX_SIGMA
-        else price
-    )
-    h.helicsPublicationPublishDouble(
-        pub,
-        price
-    )
-    t = h.helicsFederateRequestTime(fed, t+300)
+    # Control loop: read the circuit loads, compute all prices at once, publish the prices that
+    # moved (comparisons with NaN are False, so the first prices are always published)
+    for i, sub in enumerate(subs):
+        load[i] = h.helicsInputGetDouble(sub)
+    timer.lap('exchange')
+    price = model.price(t, load)
+    timer.lap('pricing')
+    publish = ~(np.abs(price - published_price) <= PRICE_DEADBAND)
+    if not EVENT_DRIVEN:
+        publish[:] = True
+    for i in np.flatnonzero(publish):
+        h.helicsPublicationPublishDouble(pubs[i], float(price[i]))
+    published_price[publish] = price[publish]
+    updates += np.count_nonzero(publish)
+    timer.lap('exchange')
+    timer.end_step(t)
+    t = h.helicsFederateRequestTime(fed, MAX_T if EVENT_DRIVEN else t+300)
+    timer.lap('helics')
+
+print(f'supplier: published {updates} prices')
+if PROFILE:
+    print(timer.summary())
+if TRACE:
+    timer.write_trace('supplier_trace.csv')
 
 # Close Helics federate
 h.helicsFederateDisconnect(fed)
@@ -0,0 +1,203 @@
+'''
+Surrogate building federate for fast price-response sweeps.
+
+Each building is replaced by a linear regression of its electricity consumption on the outdoor
+temperature, the hour of the day and the setpoint tolerance, fit to the control logs written by
+EnergyPlus runs of building.py or building_cluster.py (output/{case}/control_log.csv). All the
+buildings of a federate are predicted at once with one matrix product per timestep.
+
+The federate has the same HELICS contract as the EnergyPlus federates: it reads a config written
+by process_input.py, subscribes to supplier/price and publishes {case}/electricity_consumption.
+
+Usage, from the energyplus directory:
+    python ../surrogate.py train        fits the buildings with a control log in output/
+    python ../surrogate.py {federate}   runs the buildings of helics_config/{federate}.json
+'''
+import os
+import sys
+import csv
+import json
+import numpy as np
+from event_sync import SyncSchedule, request_time
+from run_period import read_run_period, start_day_of_year, number_of_days
+
+# Set maximum price and temperature setpoint tolerance, as in building.py
+MAX_PRICE = 4
+MAX_TOLERANCE = 4
+
+# Length of a zone timestep in seconds
+TIMESTEP = 15*60
+
+# Balance temperature in Celsius separating the heating and cooling responses
+BALANCE_TEMPERATURE = 18.0
+
+# Weather file of the simulations, and run period written by process_input.py, see run_period.py
+WEATHER_FILE = '../input/USA_WA_Seattle-Tacoma.Intl.AP.727930_TMY3.epw'
+RUN_PERIOD_FILE = 'run_period.json'
+
+# Fitted coefficients of all buildings
+MODEL_FILE = 'surrogate_model.npz'
+
+# Names of the regression features, see features
+FEATURES = [
+    'intercept', 'cooling_degrees', 'heating_degrees',
+    'sin_hour', 'cos_hour', 'sin_2hour', 'cos_2hour',
+    'tolerance', 'tolerance_cooling_degrees', 'tolerance_heating_degrees'
+]
+
+
+def features(hour, outdoor_temperature, tolerance):
+    '''
+    Returns the (n, len(FEATURES)) regression features of n timesteps. The setpoint tolerance
+    shifts the consumption directly and through the heating and cooling degrees.
+    '''
+    hour, outdoor_temperature, tolerance = np.broadcast_arrays(
+        np.asarray(hour, dtype=float),
+        np.asarray(outdoor_temperature, dtype=float),
+        np.asarray(tolerance, dtype=float)
+    )
+    cooling = np.maximum(outdoor_temperature - BALANCE_TEMPERATURE, 0)
+    heating = np.maximum(BALANCE_TEMPERATURE - outdoor_temperature, 0)
+    angle = 2*np.pi*hour/24
+    return np.stack([
+        np.ones_like(hour), cooling, heating,
+        np.sin(angle), np.cos(angle), np.sin(2*angle), np.cos(2*angle),
+        tolerance, tolerance*cooling, tolerance*heating
+    ], axis=-1)
+
+
+def read_control_log(path):
+    '''
+    Reads a control log written by building.py as a dict of column arrays.
+    '''
+    with open(path, encoding='utf-8', newline='') as file:
+        rows = list(csv.DictReader(file))
+    return {key: np.array([float(row[key]) for row in rows]) for key in rows[0]}
+
+
+def fit(log):
+    '''
+    Least-squares fit of one building's control log. Returns the coefficients and the RMSE.
+    '''
+    X = features(log['hour'], log['outdoor_temperature'], log['tolerance'])
+    coefficients, *_ = np.linalg.lstsq(X, log['consumption'], rcond=None)
+    rmse = np.sqrt(np.mean((X @ coefficients - log['consumption'])**2))
+    return coefficients, rmse
+
+
+def train(output_dir='output', model_file=MODEL_FILE):
+    '''
+    Fits every building with a control log in output_dir and saves the coefficients.
+    '''
+    cases, coefficients = [], []
+    for case in sorted(os.listdir(output_dir)):
+        path = os.path.join(output_dir, case, 'control_log.csv')
+        if not os.path.exists(path):
+            continue
+        log = read_control_log(path)
+        building_coefficients, rmse = fit(log)
+        print(f'{case}: RMSE {rmse:.1f} W, mean consumption {log["consumption"].mean():.1f} W')
+        cases.append(case)
+        coefficients.append(building_coefficients)
+    if not cases:
+        raise FileNotFoundError(f'No control_log.csv found in {output_dir}')
+    np.savez(
+        model_file, cases=np.array(cases), coefficients=np.array(coefficients),
+        features=np.array(FEATURES)
+    )
+
+
+def load_model(cases, model_file=MODEL_FILE):
+    '''
+    Returns the (len(cases), len(FEATURES)) coefficients of the given buildings.
+    '''
+    with np.load(model_file) as model:
+        if list(model['features']) != FEATURES:
+            raise ValueError(f'{model_file} was fit with other features, train it again')
+        index = {case: i for i, case in enumerate(model['cases'])}
+        missing = [case for case in cases if case not in index]
+        if missing:
+            raise KeyError(f'No surrogate model for {missing}, train it on their control logs')
+        return model['coefficients'][[index[case] for case in cases]]
+
+
+def outdoor_temperature(weather_file=WEATHER_FILE):
+    '''
+    Returns the hourly dry bulb temperatures of an EPW file. Record k is the end of hour k + 1.
+    '''
+    with open(weather_file, encoding='utf-8') as file:
+        rows = list(csv.reader(file))[8:]
+    return np.array([float(row[6]) for row in rows])
+
+
+def federate_cases(config):
+    '''
+    Returns the buildings of a federate config: one building federate, or a cluster with one
+    {case}/electricity_consumption publication per building.
+    '''
+    return [
+        pub['key'].split('/')[0] if '/' in pub['key'] else config['name']
+        for pub in config['publications']
+    ]
+
+
+def run(name):
+    '''
+    Runs the surrogate buildings of helics_config/{name}.json as one HELICS federate.
+    '''
+    import helics as h
+
+    with open(f'helics_config/{name}.json', encoding='utf-8') as file:
+        cases = federate_cases(json.load(file))
+    coefficients = load_model(cases)
+    temperatures = outdoor_temperature()
+    run_period = read_run_period(RUN_PERIOD_FILE)
+    offset = (start_day_of_year(run_period) - 1)*24
+    horizon = number_of_days(run_period)*24*3600
+
+    fed = h.helicsCreateValueFederateFromConfig(f'helics_config/{name}.json')
+    pubs = [h.helicsFederateGetPublicationByIndex(fed, i) for i in range(len(cases))]
+    sub = h.helicsFederateGetInputByIndex(fed, 0)
+
+    # Publish initial values
+    h.helicsFederateEnterInitializingMode(fed)
+    for pub in pubs:
+        h.helicsPublicationPublishComplex(pub, 0)
+
+    h.helicsFederateEnterExecutingMode(fed)
+    t = h.helicsFederateRequestTime(fed, 0)
+    price = h.helicsInputGetDouble(sub)
+    # local_t is the time of the timestep and t the HELICS time, which is only synced when a
+    # consumption changes or the sync interval has elapsed, see event_sync.py
+    local_t = 0
+    schedule = SyncSchedule(TIMESTEP)
+    # Same number of timesteps as the EnergyPlus run period
+    while local_t + TIMESTEP <= horizon:
+        # As in EnergyPlus, the consumption of a timestep follows the last price read
+        tolerance = (MAX_TOLERANCE/MAX_PRICE)*price*(5/9)
+
+        # EnergyPlus reports at the end of the zone timestep
+        hours = offset + (local_t + TIMESTEP)/3600
+        temperature = np.interp(
+            hours, np.arange(1, len(temperatures) + 1), temperatures, period=len(temperatures)
+        )
+        consumption = np.maximum(coefficients @ features(hours % 24, temperature, tolerance), 0)
+        if schedule.due(local_t, consumption):
+            t = request_time(fed, t, local_t)
+            for pub, value in zip(pubs, consumption):
+                h.helicsPublicationPublishComplex(pub, value)
+            price = h.helicsInputGetDouble(sub)
+        local_t += TIMESTEP
+    print(f'{name}: synced {schedule.syncs} of {local_t//TIMESTEP} timesteps')
+
+    # Close Helics federate
+    h.helicsFederateDisconnect(fed)
+    h.helicsFederateFree(fed)
+    h.helicsCloseLibrary()
+
+
+if __name__ == '__main__':
+    if sys.argv[1] == 'train':
+        train()
+    else:
+        run(sys.argv[1])
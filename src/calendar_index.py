@@ -0,0 +1,65 @@
+import functools
+import numpy as np
+import pandas as pd
+from pandas.tseries.holiday import USFederalHolidayCalendar
+
+# Peak season, consistent with EPRI: months of May through September
+PEAK_MONTHS = [5, 6, 7, 8, 9]
+# Day types, in the same order as the EPRI season/day profiles used by the industry model
+DAY_TYPES = ['peak_wkdy', 'peak_wknd', 'offpeak_wkdy', 'offpeak_wknd']
+DAY_NAMES = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+# Daily calendar of a year, built once per year and cached. The returned DataFrame is shared
+# between callers and must not be modified.
+#
+# year: calendar year
+# Returns a DataFrame indexed by date with the columns:
+# - month, day: month and day of the month
+# - weekday: 0 (Monday) to 6 (Sunday)
+# - is_weekend, is_holiday: weekend and US federal holiday flags
+# - is_peak_season: peak season flag
+# - day_type: index into DAY_TYPES, holidays keep the type of their weekday
+@functools.lru_cache(maxsize=None)
+def day_index(year):
+    dates = pd.date_range(f'{year}-01-01', f'{year}-12-31', freq='D')
+    holidays = USFederalHolidayCalendar().holidays(start=dates[0], end=dates[-1])
+    df = pd.DataFrame(index=dates)
+    df['month'] = dates.month
+    df['day'] = dates.day
+    df['weekday'] = dates.weekday
+    df['is_weekend'] = df['weekday'].to_numpy() >= 5
+    df['is_holiday'] = dates.isin(holidays)
+    df['is_peak_season'] = dates.month.isin(PEAK_MONTHS)
+    df['day_type'] = 2*(~df['is_peak_season'].to_numpy()) + df['is_weekend'].to_numpy()
+    return df
+
+# Hourly or sub-hourly calendar of a year, built once per (year, steps_per_hour) and cached. The
+# returned DataFrame is shared between callers and must not be modified.
+#
+# year: calendar year
+# steps_per_hour: number of time steps per hour, e.g. 4 for 15 minutes
+# Returns a DataFrame indexed by the start time of each step with the columns of day_index and
+# hour (0 to 23)
+@functools.lru_cache(maxsize=None)
+def calendar_index(year, steps_per_hour=1):
+    days = day_index(year)
+    steps_per_day = 24*steps_per_hour
+    timestamps = pd.date_range(f'{year}-01-01', periods=len(days)*steps_per_day, freq=pd.Timedelta(hours=1/steps_per_hour))
+    df = pd.DataFrame(
+        {column: np.repeat(days[column].to_numpy(), steps_per_day) for column in days.columns},
+        index=timestamps
+    )
+    df['hour'] = np.tile(np.repeat(np.arange(24), steps_per_hour), len(days))
+    return df
+
+# Find a year whose Jan 1 falls on start_day and with number_of_days_in_one_year days. Such a
+# year always exists in any 28-year span, as the calendar repeats every 28 years.
+#
+# start_day: the day of Jan 1 [Monday, Tuesday, Wednesday, Thursday, Friday, Saturday, Sunday]
+# number_of_days_in_one_year: [365, 366]
+def reference_year(start_day, number_of_days_in_one_year, first_year=2001):
+    for year in range(first_year, first_year + 28):
+        is_leap = pd.Timestamp(f'{year}-12-31').dayofyear == 366
+        if DAY_NAMES[pd.Timestamp(f'{year}-01-01').weekday()] == start_day and is_leap == (number_of_days_in_one_year == 366):
+            return year
+    raise ValueError(f'No year starts on {start_day} with {number_of_days_in_one_year} days')
@@ -1,178 +1,298 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import pandas as pd
+from calendar_index import DAY_NAMES, DAY_TYPES, calendar_index, day_index, reference_year
+from profile_io import profile_format, write_profiles
+
+# Input and output directories, relative to this file so the module can be run from anywhere
+INPUT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'input_data', 'industry')
+OUTPUT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'output')
+
+# Other ("All Regions" only) is not considered in the industry sector in the EPRI
+END_USES = ['HVAC', 'Lighting', 'Machine Drives', 'Process Heating']
+# Peak season and off peak season's average weekday and weekend are used in this study, in the
+# same order as the day types in DAY_TYPES
+# Peak weekday data is not used
+SEASON_DAYS = ['Peak Season, Average Weekday', 'Peak Season, Average Weekend',
+               'Off Peak Season, Average Weekday', 'Off Peak Season, Average Weekend']
+# Number of days for each season_day in SEASON_DAYS
+# Based on the description of EPRI: peak season: months of May through September; off-peak
+# season: months of October through April
+# In this estimation, we make the following assumptions:
+# - Number of days for each month is even (365/12)
+# - The ratio of weekday and weekend is 5:2
+# The value under each key is calculated by total days in one year/total months in one year
+# *number of months under a certain season*number of days in one week/total days in one week
+SEASONS_DAYS = np.array([365.0/12.0*5.0*5.0/7.0,
+                         365.0/12.0*5.0*2.0/7.0,
+                         365.0/12.0*7.0*5.0/7.0,
+                         365.0/12.0*7.0*2.0/7.0])
+
+# Stochastic facility synthesis. Every facility follows the EPRI profile with:
+# - a lognormal size with mean 1 and standard deviation of its log SIZE_SIGMA
+# - an end-use mix drawn from a Dirichlet distribution centered on the EPRI end-use shares, the
+#   larger MIX_CONCENTRATION the closer the mixes are to the EPRI shares
+# - a lognormal load multiplier for every day of the year, with mean 1 and standard deviation of
+#   its log DAY_SIGMA
+# - a shift schedule: 1, 2 or 3 shifts of SHIFT_HOURS hours (drawn with SHIFT_PROBABILITIES)
+#   starting at one of SHIFT_STARTS. Outside the shifts the load drops to SHIFT_BASE_LOAD times the
+#   EPRI load, and the daily energy of each end use is kept.
+SIZE_SIGMA = 1.0
+MIX_CONCENTRATION = 20.0
+DAY_SIGMA = 0.15
+SHIFT_HOURS = 8
+SHIFT_PROBABILITIES = np.array([0.3, 0.4, 0.3])
+SHIFT_BASE_LOAD = np.array([0.6, 0.8, 1.0])
+SHIFT_STARTS = np.arange(5, 10)
 
 # Based on start_day and number_of_days_in_one_year, calculate if days are the peak/offpeak season and 
-# weekday/weekend
+# weekday/weekend, from the cached calendar of a year with the same first day and length
 #
 # start_day: the assumption of day in Jan 1 [Monday, Tuesday, Wednesday, Thursday, Friday, Saturday, Sunday]
 #  number_of_days_in_one_year: [365, 366]
 def day_calculation(start_day, number_of_days_in_one_year):
-    day_list = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
-    month_day = {'Jan': 31,
-                 'Feb': 28,
-                 'Mar': 31,
-                 'Apr': 30,
-                 'May': 31,
-                 'Jun': 30,
-                 'Jul': 31,
-                 'Aug': 31,
-                 'Sep': 30,
-                 'Oct': 31,
-                 'Nov': 30,
-                 'Dec': 31}
-    if number_of_days_in_one_year == 366:
-        month_day['Feb'] = 29
-    # Identify the index in the day_list for start_day
-    day_index = day_list.index(start_day)
-    month_day_rec = []# month-day
-    day_rec = []# Monday, Tuesday, Wednesday, Thursday, Friday, Saturday, or Sunday
-    season_day_rec = []# peak_wkdy, peak_wknd, offpeak_wkdy, offpeak_wknd
-    for key in month_day:
-        for i in range(month_day[key]):
-            month_day_rec.append(key + '-' + str(i+1))
-            day_rec.append(day_list[day_index])
-            if key in ['May', 'Jun', 'Jul', 'Aug', 'Sep']:
-                if day_index == 5 or day_index == 6:
-                    season_day_rec.append('peak_wknd')
-                else:
-                    season_day_rec.append('peak_wkdy')
-            else:
-                if day_index == 5 or day_index == 6:
-                    season_day_rec.append('offpeak_wknd')
-                else:
-                    season_day_rec.append('offpeak_wkdy')
-            if day_index == 6:
-                day_index = 0
-            else:
-                day_index += 1
+    days = day_index(reference_year(start_day, number_of_days_in_one_year))
+    month_day_rec = list(days.index.strftime('%b-') + days['day'].astype(str))# month-day
+    day_rec = list(np.array(DAY_NAMES)[days['weekday']])# Monday, Tuesday, Wednesday, Thursday, Friday, Saturday, or Sunday
+    season_day_rec = list(np.array(DAY_TYPES)[days['day_type']])# peak_wkdy, peak_wknd, offpeak_wkdy, offpeak_wknd
     return month_day_rec, day_rec, season_day_rec
-    
-# Step 1: Use EPRI to calculate estimated annual energy consumption for a single industry facility.
-# Step 2: Use Nw Council power demand to calculate annual energy consumption for the NW industry sector.
-# Step 3: Based on the outputs of Steps 1 and 2, calculate the number of industry facilities in the NW.
-# Step 4: Based on the load profiles for individual industry facilities in EPRI and number of industry 
-# facilities, calculate the estimated aggregated load profile for the industry sector in the NW.
+
+# Pivot the EPRI hourly load shapes into a tensor of hourly loads for a single industry facility
 #
-# start_day: the assumption of day in Jan 1 [Monday, Tuesday, Wednesday, Thursday, Friday, Saturday, Sunday]
-# number_of_days_in_one_year: [365, 366]
-# output_path: the path of output csv file
-def num_industry_estimation(start_day, number_of_days_in_one_year, output_path):
-    # Step 1:
+# load_profile_single_industry: EPRI.csv as a DataFrame
+# Returns an (end use x season_day x hour) array in MW, ordered as END_USES and SEASON_DAYS
+def load_profile_tensor(load_profile_single_industry):
+    profiles = load_profile_single_industry.set_index(['End Use', 'Season/Day'])
+    profiles = profiles.loc[pd.MultiIndex.from_product([END_USES, SEASON_DAYS])]
+    hourly = profiles[[str(hour) for hour in range(1,25)]].to_numpy()
+    tensor = hourly * profiles['Nominal Value'].to_numpy()[:, None] / 1000.0 # Unit: MW
+    return tensor.reshape(len(END_USES), len(SEASON_DAYS), 24)
+
+# Load the industry inputs once
+#
+# input_dir: directory holding EPRI.csv and NW_Council_aMW.csv
+# Returns the (end use x season_day x hour) single facility tensor in MW, and the aMW table
+# indexed by scenario name with one integer column per year
+def load_inputs(input_dir=INPUT_DIR):
     # Get hourly load profiles from EPRI.csv
     # EPRI.csv was generated based on EPRI End Use: https://loadshape.epri.com/enduse
-    load_profile_single_industry = pd.read_csv('../input_data/industry/EPRI.csv')
-    # Other ("All Regions" only) is not considered in the industry sector in the EPRI
-    end_uses = ['HVAC', 'Lighting', 'Machine Drives', 'Process Heating']
-    # Peak season and off peak season's average weekday and weekend are used in this study
-    # Peak weekday data is not used
-    # This dictionary: {season_day: number of days}
-    # Based on the description of EPRI: peak season: months of May through September; off-peak
-    # season: months of October through April
-    # In this estimation, we make the following assumptions:
-    # - Number of days for each month is even (365/12)
-    # - The ratio of weekday and weekend is 5:2
-    # The value under each key is calculated by total days in one year/total months in one year
-    # *number of months under a certain season*number of days in one week/total days in one week
-    seasons_days = {'Peak Season, Average Weekday': 365.0/12.0*5.0*5.0/7.0,
-                    'Peak Season, Average Weekend': 365.0/12.0*5.0*2.0/7.0,
-                    'Off Peak Season, Average Weekday': 365.0/12.0*7.0*5.0/7.0,
-                    'Off Peak Season, Average Weekend': 365.0/12.0*7.0*2.0/7.0}
-    # Calculate the annual energy consumption for a single industry facility
-    annual_energy_consumption_single_industry = 0
-    for end_use in end_uses:
-        for key_season_day in seasons_days:
-            for i in range(len(load_profile_single_industry)):
-                if load_profile_single_industry['End Use'][i] == end_use and load_profile_single_industry['Season/Day'][i] == key_season_day:
-                    nominal_value = load_profile_single_industry['Nominal Value'][i]
-                    for hour in range(1,25):
-                        annual_energy_consumption_single_industry += nominal_value * load_profile_single_industry[str(hour)][i] * seasons_days[key_season_day] / 1000.0 # Unit: MWh
-                    break
-    
-    # Step 2:
+    load_profile = load_profile_tensor(pd.read_csv(os.path.join(input_dir, 'EPRI.csv')))
     # Get aMW (Average MW) from NW_Council_aMW.csv
     # NW_Council_aMW.csv was obtained from NW Council Industrial Sector Energy Use Forecasts: 
     # https://www.nwcouncil.org/2021powerplan_industrial-sector-energy-use-forecasts/
     # 2021powerplan_DemandData.xlsx
     # All Industrial tab
-    amw_nw_industry_sector = pd.read_csv('../input_data/industry/NW_Council_aMW.csv')
-    # This research selects BaseCase scenario 2019 to calculate annual energy consumption for the NW industry sector
-    for i in range(len(amw_nw_industry_sector)):
-        if 'Scenario Name: BaseCase' in amw_nw_industry_sector['Scenario'][i]:
-            amw_total = amw_nw_industry_sector['2019'][i]
-            break
+    amw = pd.read_csv(os.path.join(input_dir, 'NW_Council_aMW.csv'))
+    amw.index = amw['Scenario'].str.extract(r'Scenario Name: ([^|]+?)\s*\|', expand=False)
+    amw = amw.drop(columns='Scenario')
+    amw.columns = amw.columns.astype(int)
+    return load_profile, amw
+
+# Daily profiles of every shift schedule, the schedules are indexed by
+# (number of shifts - 1) * len(SHIFT_STARTS) + start index
+#
+# load_profile: (end use x season_day x hour) single facility tensor from load_profile_tensor
+# Returns a (schedule x end use x season_day x hour) array
+def shift_schedules(load_profile):
+    shifts = np.arange(1, len(SHIFT_BASE_LOAD) + 1)
+    # (number of shifts x start x hour) load factors
+    on_shift = (np.arange(24) - SHIFT_STARTS[:, None]) % 24 < SHIFT_HOURS * shifts[:, None, None]
+    factors = np.where(on_shift, 1.0, SHIFT_BASE_LOAD[:, None, None]).reshape(-1, 1, 1, 24)
+    schedules = load_profile * factors
+    return schedules * load_profile.sum(axis=-1, keepdims=True) / schedules.sum(axis=-1, keepdims=True)
+
+# Synthesize heterogeneous industry facilities and aggregate them over a year. Facility sizes are
+# scaled so the sector keeps the annual energy of number_industry_facilities EPRI average
+# facilities. Within a shift schedule, facilities only differ by their end-use weights and daily
+# load multipliers, so the aggregate is built one schedule at a time from (day x end use) sums and
+# each facility's peak from its daily peaks, without building any facility's hourly profile.
+#
+# load_profile: (end use x season_day x hour) single facility tensor from load_profile_tensor
+# day_type: (days, ) index into SEASON_DAYS of every day of the year
+# number_industry_facilities: number of EPRI average facilities from number_of_facilities
+# n_facilities: number of synthetic facilities, round(number_industry_facilities) if None
+# seed: seed of the random generator
+# Returns the aggregated (end use x hour of the year) profile in MW and a dict of diversity
+# statistics, where the diversity factor is the sum of the facility peaks over the coincident peak
+def synthesize_facilities(load_profile, day_type, number_industry_facilities, n_facilities=None, seed=None):
+    rng = np.random.default_rng(seed)
+    n_facilities = int(round(number_industry_facilities)) if n_facilities is None else int(n_facilities)
+    schedules = shift_schedules(load_profile)
+
+    size = rng.lognormal(-SIZE_SIGMA**2/2.0, SIZE_SIGMA, n_facilities)
+    size *= number_industry_facilities / size.sum()
+    # Annual energy share of each end use
+    share = np.einsum('esh,s->e', load_profile, SEASONS_DAYS)
+    share /= share.sum()
+    weights = size[:, None] * rng.dirichlet(MIX_CONCENTRATION * share, n_facilities) / share
+    schedule = rng.choice(len(SHIFT_BASE_LOAD), size=n_facilities, p=SHIFT_PROBABILITIES) * len(SHIFT_STARTS) \
+        + rng.integers(len(SHIFT_STARTS), size=n_facilities)
+
+    aggregate = np.zeros((len(END_USES), len(day_type), 24))
+    facility_peaks = np.empty(n_facilities)
+    for g in np.unique(schedule):
+        members = np.flatnonzero(schedule == g)
+        # (facility x day) load multipliers with mean 1
+        daily_load = rng.lognormal(-DAY_SIGMA**2/2.0, DAY_SIGMA, (len(members), len(day_type)))
+        aggregate += np.einsum('de,edh->edh', daily_load.T @ weights[members], schedules[g][:, day_type, :])
+        # (facility x season_day) peak of each day type
+        day_peaks = np.einsum('ie,esh->ish', weights[members], schedules[g]).max(axis=2)
+        facility_peaks[members] = (daily_load * day_peaks[:, day_type]).max(axis=1)
+    aggregate = aggregate.reshape(len(END_USES), -1)
+    coincident_peak = aggregate.sum(axis=0).max()
+    stats = {
+        'number_of_facilities': n_facilities,
+        'sum_of_facility_peaks_MW': facility_peaks.sum(),
+        'coincident_peak_MW': coincident_peak,
+        'average_profile_peak_MW': load_profile.sum(axis=0).max() * number_industry_facilities,
+        'diversity_factor': facility_peaks.sum() / coincident_peak,
+        'coincidence_factor': coincident_peak / facility_peaks.sum(),
+        'facility_peak_percentiles_MW': dict(zip([5, 50, 95], np.percentile(facility_peaks, [5, 50, 95]))),
+    }
+    return aggregate, stats
+
+# Step 1: Use EPRI to calculate estimated annual energy consumption for a single industry facility.
+# Step 2: Use Nw Council power demand to calculate annual energy consumption for the NW industry sector.
+# Step 3: Based on the outputs of Steps 1 and 2, calculate the number of industry facilities in the NW.
+#
+# load_profile: (end use x season_day x hour) single facility tensor from load_profile_tensor
+# amw_total: aMW of the NW industry sector, a scalar or an array for several scenarios and years
+def number_of_facilities(load_profile, amw_total):
+    # Step 1:
+    # Calculate the annual energy consumption for a single industry facility
+    annual_energy_consumption_single_industry = np.einsum('esh,s->', load_profile, SEASONS_DAYS) # Unit: MWh
+    # Step 2:
     # Annual energy consumption for the NW industry sector = aMW * 365 (days) * 24 (hours)
-    annual_energy_consumption_industry_sector = amw_total * 24.0 * 365.0
-    
+    annual_energy_consumption_industry_sector = np.asarray(amw_total) * 24.0 * 365.0
     # Step 3:
     # Number of industry facilities = annual_energy_consumption_industry_sector / annual_energy_consumption_single_industry
-    number_industry_facilities = annual_energy_consumption_industry_sector / annual_energy_consumption_single_industry
+    return annual_energy_consumption_industry_sector / annual_energy_consumption_single_industry
+
+# Step 4 for a single industry facility: gather the day type of every day of the year
+#
+# Returns the (end use x hour of the year) profile and the day labels from day_calculation
+def annual_profile(load_profile, start_day, number_of_days_in_one_year):
+    # Calculate if days are the peak/offpeak season and weekday/weekend
+    month_day_rec, day_rec, season_day_rec = day_calculation(start_day, number_of_days_in_one_year)
+    profile = load_profile[:, annual_day_types(start_day, number_of_days_in_one_year), :].reshape(len(END_USES), -1)
+    return profile, (month_day_rec, day_rec, season_day_rec)
+
+# Index into SEASON_DAYS of every day of a year that starts on start_day
+def annual_day_types(start_day, number_of_days_in_one_year):
+    return day_index(reference_year(start_day, number_of_days_in_one_year))['day_type'].to_numpy()
+
+# Step 4 for a single industry facility in a given calendar year, with its own weekdays and length
+#
+# Returns the (end use x hour of the year) profile
+def calendar_year_profile(load_profile, year):
+    return load_profile[:, day_index(year)['day_type'].to_numpy(), :].reshape(len(END_USES), -1)
+
+# Step 4: Based on the load profiles for individual industry facilities in EPRI and number of industry 
+# facilities, calculate the estimated aggregated load profile for the industry sector in the NW.
+#
+# start_day: the assumption of day in Jan 1 [Monday, Tuesday, Wednesday, Thursday, Friday, Saturday, Sunday]
+# number_of_days_in_one_year: [365, 366]
+# output_path: the path of output file, not written if None. A .csv file keeps the labelled hourly
+#   table, a .parquet, .arrow or .npz file stores the profiles as float32 with typed timestamps of
+#   timestamp_year, see profile_io.write_profiles
+# scenario: scenario name in NW_Council_aMW.csv
+# year: year in NW_Council_aMW.csv
+# inputs: output of load_inputs, loaded from INPUT_DIR if None
+# synthetic: aggregate heterogeneous facilities from synthesize_facilities instead of scaling the
+#   EPRI average facility, the diversity statistics are stored in df.attrs['diversity']
+# n_facilities: number of synthetic facilities, see synthesize_facilities
+# seed: seed of the synthetic facilities
+# timestamp_year: calendar year of the timestamps of a binary output, year if None. Its Jan 1 must
+#   fall on start_day and it must have number_of_days_in_one_year days, e.g. 2019 starts on Tuesday
+# compression: codec of a binary output, see profile_io.write_profiles. None writes uncompressed
+#   files, which are read back with zero copy from Arrow IPC
+def num_industry_estimation(start_day, number_of_days_in_one_year, output_path, scenario='BaseCase', year=2019, inputs=None,
+                            synthetic=False, n_facilities=None, seed=None, timestamp_year=None, compression='zstd'):
+    timestamps = None
+    if output_path is not None and profile_format(output_path) != 'csv':
+        timestamp_year = year if timestamp_year is None else timestamp_year
+        days = day_index(timestamp_year)
+        if DAY_NAMES[days['weekday'].iat[0]] != start_day or len(days) != number_of_days_in_one_year:
+            raise ValueError(f'{timestamp_year} does not start on {start_day} with {number_of_days_in_one_year} days, '
+                             'set timestamp_year to a year that does')
+        timestamps = calendar_index(timestamp_year).index
+    load_profile, amw = load_inputs() if inputs is None else inputs
+    # This research selects BaseCase scenario 2019 by default to calculate annual energy consumption for the NW industry sector
+    number_industry_facilities = number_of_facilities(load_profile, amw.loc[scenario, year])
     
-    # Step 4:
-    # Hourly load profiles from EPRI.csv * Number of industry facilities
-    # Calculate end-use load profile for the NW industry sector
-    # agg_load_profile:
-    # First layer: end_uses = ['HVAC', 'Lighting', 'Machine Drives', 'Process Heating']
-    # Second layer: seasons_days = ['Peak Season, Average Weekday', 'Peak Season, Average Weekend', 
-    # 'Off Peak Season, Average Weekday', 'Off Peak Season, Average Weekend']
-    # Third layer: hourly load profile
-    agg_load_profile = []
-    for end_use in end_uses:
-        agg_load_profile_enduse = []
-        for key_season_day in seasons_days:
-            agg_load_profile_enduse_seasonday = []
-            for i in range(len(load_profile_single_industry)):
-                if load_profile_single_industry['End Use'][i] == end_use and load_profile_single_industry['Season/Day'][i] == key_season_day:
-                    nominal_value = load_profile_single_industry['Nominal Value'][i]
-                    for hour in range(1,25):
-                        agg_load_profile_enduse_seasonday.append(nominal_value * load_profile_single_industry[str(hour)][i] / 1000.0 * number_industry_facilities) # Unit: MWh
-                    break
-            agg_load_profile_enduse.append(agg_load_profile_enduse_seasonday)
-        agg_load_profile.append(agg_load_profile_enduse)
+    if synthetic:
+        day_type = annual_day_types(start_day, number_of_days_in_one_year)
+        agg_load_profile_enduse, stats = synthesize_facilities(load_profile, day_type, number_industry_facilities, n_facilities, seed)
+        month_day_rec, day_rec, season_day_rec = day_calculation(start_day, number_of_days_in_one_year)
+    else:
+        # Hourly load profiles from EPRI.csv * Number of industry facilities
+        profile, (month_day_rec, day_rec, season_day_rec) = annual_profile(load_profile, start_day, number_of_days_in_one_year)
+        agg_load_profile_enduse = profile * number_industry_facilities
     
     # Store the result to csv file
-    # Calculate if days are the peak/offpeak season and weekday/weekend
-    month_day_rec, day_rec, season_day_rec = day_calculation(start_day, number_of_days_in_one_year)
-    # Aggregated total and enduse load profiles
-    agg_load_profile_total = []
-    agg_load_profile_hvac = []
-    agg_load_profile_lighting = []
-    agg_load_profile_machine_drives = []
-    agg_load_profile_process_heating = []
-    for x in season_day_rec:
-        if x == 'peak_wkdy':
-            k = 0
-        elif x == 'peak_wknd':
-            k = 1
-        if x == 'offpeak_wkdy':
-            k = 2
-        else:
-            k = 3
-        for i in range(24):
-            agg_load_profile_total.append(agg_load_profile[0][k][i] + agg_load_profile[1][k][i] + agg_load_profile[2][k][i] + agg_load_profile[3][k][i])
-            agg_load_profile_hvac.append(agg_load_profile[0][k][i])
-            agg_load_profile_lighting.append(agg_load_profile[1][k][i])
-            agg_load_profile_machine_drives.append(agg_load_profile[2][k][i])
-            agg_load_profile_process_heating.append(agg_load_profile[3][k][i])
-    # update month_day_rec, day_rec, season_day_rec, and add time information
-    month_day_hr_rec = []
-    day_hr_rec = []
-    season_day_hr_rec = []
-    time = []
-    for i in range(number_of_days_in_one_year):
-        for j in range(1,25):
-            month_day_hr_rec.append(month_day_rec[i])
-            day_hr_rec.append(day_rec[i])
-            season_day_hr_rec.append(season_day_rec[i])
-            time.append(j)
     df = pd.DataFrame()
-    df['Month/Day'] = month_day_hr_rec
-    df['Week_Day'] = day_hr_rec
-    df['Season/Weekday'] = season_day_hr_rec
-    df['Time'] = time
-    df['Aggregated Total Load Profile [MWh]'] = agg_load_profile_total
-    df['Aggregated HVAC Load Profile [MWh]'] = agg_load_profile_hvac
-    df['Aggregated Lighting Load Profile [MWh]'] = agg_load_profile_lighting
-    df['Aggregated Machine Drives Load Profile [MWh]'] = agg_load_profile_machine_drives
-    df['Aggregated Process Heating Load Profile [MWh]'] = agg_load_profile_process_heating
-    df.to_csv(output_path, index = False)
+    df['Month/Day'] = np.repeat(month_day_rec, 24)
+    df['Week_Day'] = np.repeat(day_rec, 24)
+    df['Season/Weekday'] = np.repeat(season_day_rec, 24)
+    df['Time'] = np.tile(np.arange(1,25), number_of_days_in_one_year)
+    df['Aggregated Total Load Profile [MWh]'] = agg_load_profile_enduse.sum(axis=0)
+    df['Aggregated HVAC Load Profile [MWh]'] = agg_load_profile_enduse[0]
+    df['Aggregated Lighting Load Profile [MWh]'] = agg_load_profile_enduse[1]
+    df['Aggregated Machine Drives Load Profile [MWh]'] = agg_load_profile_enduse[2]
+    df['Aggregated Process Heating Load Profile [MWh]'] = agg_load_profile_enduse[3]
+    if synthetic:
+        df.attrs['diversity'] = stats
+    if output_path is not None:
+        if timestamps is None:
+            df.to_csv(output_path, index = False)
+        else:
+            write_profiles(df.iloc[:, 4:].set_axis(timestamps), output_path, compression=compression)
+    return df
+
+# Build the long-format table of one scenario for all years, run in the batch worker processes.
+# Every year has its own profile from calendar_year_profile, leap years have 8784 hours.
+def _scenario_table(args):
+    scenario, years, number_industry_facilities, profiles = args
+    # (end use x hour of all years)
+    loads = np.concatenate([n * profile for n, profile in zip(number_industry_facilities, profiles)], axis=1)
+    hours = [profile.shape[1] for profile in profiles]
+    index = pd.MultiIndex.from_arrays(
+        [np.repeat([scenario], loads.shape[1]), np.repeat(years, hours), np.concatenate([np.arange(1, n + 1) for n in hours])],
+        names=['Scenario', 'Year', 'Hour']
+    )
+    columns = {'Aggregated Total Load Profile [MWh]': loads.sum(axis=0)}
+    for i, end_use in enumerate(END_USES):
+        columns[f'Aggregated {end_use} Load Profile [MWh]'] = loads[i]
+    return pd.DataFrame(columns, index=index)
+
+# Estimate the aggregated industry load profile for every scenario x forecast year in one call.
+# The inputs are loaded once and the single facility profile is built once per forecast year, from
+# the cached calendar of that year, as scenarios only scale it by their number of industry facilities.
+#
+# output_path: the path of output Parquet file, not written if None
+# scenarios: scenario names in NW_Council_aMW.csv, all scenarios if None
+# years: years in NW_Council_aMW.csv, all years if None
+# max_workers: number of processes building the table, built in this process if 1
+# Returns a DataFrame indexed by (Scenario, Year, Hour) with the total and end-use load profiles
+def batch_industry_estimation(output_path=None, scenarios=None, years=None, max_workers=None):
+    load_profile, amw = load_inputs()
+    scenarios = list(amw.index) if scenarios is None else list(scenarios)
+    years = list(amw.columns) if years is None else list(years)
+    # (scenario x year) number of industry facilities
+    number_industry_facilities = number_of_facilities(load_profile, amw.loc[scenarios, years].to_numpy())
+    profiles = [calendar_year_profile(load_profile, int(year)) for year in years]
     
-num_industry_estimation('Sunday', 365, '../output/output_industry.csv')
+    tasks = [(scenario, years, number_industry_facilities[i], profiles) for i, scenario in enumerate(scenarios)]
+    if max_workers == 1:
+        frames = [_scenario_table(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            frames = list(executor.map(_scenario_table, tasks))
+    df = pd.concat(frames)
+    if output_path is not None:
+        df.to_parquet(output_path)
+    return df
+
+if __name__ == '__main__':
+    num_industry_estimation('Sunday', 365, os.path.join(OUTPUT_DIR, 'output_industry.csv'))
@@ -0,0 +1,198 @@
+import os
+import re
+import numpy as np
+import pandas as pd
+from profile_io import TIME_COLUMN, read_profile_arrays, write_profiles
+
+OUTPUT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'output')
+
+# Total column of each sector output, with its unit in brackets
+SECTOR_COLUMNS = {
+    'industry': 'Aggregated Total Load Profile [MWh]',
+    'transport': 'Total Charging [kWh]',
+}
+# Energy units of the profiles, converted to MWh
+UNITS = {'Wh': 1e-6, 'kWh': 1e-3, 'MWh': 1.0, 'J': 1.0/3.6e9}
+# Number of building profiles summed at once, the memory used is chunk_size x number of steps
+CHUNK_SIZE = 1024
+
+# Factor converting a profile to MWh from the unit in brackets at the end of its column name
+def unit_factor(column, default='MWh'):
+    match = re.search(r'\[(\w+)\]\s*$', column)
+    return UNITS[match.group(1) if match else default]
+
+# Read the total profile of a sector in MWh per step, without timestamps for the labelled industry
+# CSV written by num_industry_estimation. The profile keeps the dtype of the file, so a float32
+# profile in MWh read from an uncompressed Arrow IPC file is not copied.
+#
+# path: profile file written by profile_io.write_profiles or the industry CSV
+# column: profile column, its unit is read from the brackets in its name
+# Returns the timestamps (None if the file has none) and the profile
+def sector_profile(path, column):
+    factor = unit_factor(column)
+    if path.endswith('.csv') and TIME_COLUMN not in pd.read_csv(path, nrows=0).columns:
+        return None, pd.read_csv(path, usecols=[column])[column].to_numpy(dtype=float) * factor
+    timestamps, arrays = read_profile_arrays(path, [column])
+    profile = arrays[column]
+    return timestamps, profile if factor == 1 else profile * profile.dtype.type(factor)
+
+# Sum the building profiles in chunks. A 2-D .npy file of (buildings x steps) is memory mapped and
+# summed chunk_size buildings at a time; a directory holds one 1-D .npy profile per building and is
+# summed file by file. Apart from the mapped pages, which the OS can drop, memory use does not
+# depend on the number of buildings.
+#
+# path: .npy file or directory of .npy files
+# unit: unit of the building profiles, a key of UNITS
+# chunk_size: number of buildings summed at once
+# Returns the (steps, ) total of all buildings in MWh per step and the number of buildings
+def sum_building_profiles(path, unit='kWh', chunk_size=CHUNK_SIZE):
+    if os.path.isdir(path):
+        files = sorted(f for f in os.listdir(path) if f.endswith('.npy'))
+        if not files:
+            raise FileNotFoundError(f'No .npy building profiles in {path}')
+        total = None
+        for fname in files:
+            profile = np.load(os.path.join(path, fname), mmap_mode='r')
+            total = profile.astype(float) if total is None else total + profile
+        return total * UNITS[unit], len(files)
+    profiles = np.load(path, mmap_mode='r')
+    total = np.zeros(profiles.shape[1])
+    for start in range(0, profiles.shape[0], chunk_size):
+        total += profiles[start:start + chunk_size].sum(axis=0, dtype=float)
+    return total * UNITS[unit], profiles.shape[0]
+
+# Time step of a profile from the spacing of its timestamps, which must be regular
+#
+# timestamps: datetime64 timestamps of the profile
+# name: profile name used in the error messages
+def profile_step(timestamps, name):
+    if len(timestamps) < 2:
+        raise ValueError(f'The {name} profile needs at least two timestamps to infer its time step')
+    steps = np.unique(np.diff(timestamps))
+    if len(steps) != 1 or steps[0] <= np.timedelta64(0):
+        raise ValueError(f'The timestamps of the {name} profile are not evenly spaced')
+    return pd.Timedelta(steps[0])
+
+# Repeat a coarser profile to the number of steps of the other profiles, e.g. hourly industry
+# loads next to 15 minute building loads. The energy of each step is split evenly.
+def align_steps(profile, number_of_steps):
+    if len(profile) == number_of_steps:
+        return profile
+    if number_of_steps % len(profile):
+        raise ValueError(f'Cannot align a profile of {len(profile)} steps to {number_of_steps} steps')
+    ratio = number_of_steps // len(profile)
+    return np.repeat(profile / ratio, ratio)
+
+# Load-duration curve: loads sorted from highest to lowest
+def load_duration_curve(load):
+    return np.sort(load)[::-1]
+
+# Supply-gap statistics of a demand against a supply, both in MW
+#
+# demand: (steps, ) demand
+# supply: (steps, ) supply or a scalar capacity
+# steps_per_hour: number of time steps per hour
+def gap_statistics(demand, supply, steps_per_hour=1):
+    gap = demand - supply # positive when the demand is not met
+    return {
+        'peak_gap_MW': gap.max(),
+        'shortfall_hours': np.count_nonzero(gap > 0) / steps_per_hour,
+        'unserved_energy_MWh': gap[gap > 0].sum() / steps_per_hour,
+        'surplus_energy_MWh': -gap[gap < 0].sum() / steps_per_hour,
+    }
+
+# Aggregate the building and sector loads into the system load and compute its statistics. The
+# time step of a profile with timestamps is inferred from their spacing. The profiles without
+# timestamps, the industry CSV and the building profiles, are lined up by length: the longest one
+# starts at start with steps_per_hour steps per hour and the others must divide into its horizon.
+# Every profile must cover the same span, and coarser profiles are resampled to the finest time step.
+#
+# building_path: .npy file or directory of building profiles, see sum_building_profiles, or None
+# sector_paths: dict of sector name to profile file, the total column is taken from SECTOR_COLUMNS
+# supply: supply in MW, a scalar capacity, a (steps, ) array, or None to skip the gap statistics
+# steps_per_hour: number of time steps per hour of the longest profile without timestamps, required
+#                 with start when there is such a profile
+# building_unit: unit of the building profiles
+# output_path: profile file for the sector and system loads in MW, not written if None
+# start: first timestamp of the profiles without timestamps, e.g. '2019-01-01'
+# Returns the DataFrame of sector and system loads in MW, the load-duration curve of the system
+# load and the dict of statistics
+def aggregate(building_path=None, sector_paths=None, supply=None, steps_per_hour=None, building_unit='kWh',
+              output_path=None, start=None, chunk_size=CHUNK_SIZE):
+    energies = {}
+    timestamps = {}
+    for sector, path in (sector_paths or {}).items():
+        timestamps[sector], energies[sector] = sector_profile(path, SECTOR_COLUMNS[sector])
+    # Check before the building profiles are summed that the profiles without timestamps can be placed
+    untimed = [sector for sector, sector_timestamps in timestamps.items() if sector_timestamps is None]
+    if building_path is not None:
+        untimed.append('buildings')
+    if untimed and (start is None or steps_per_hour is None):
+        raise ValueError(f"The {', '.join(untimed)} profiles have no timestamps, set start and steps_per_hour")
+    stats = {}
+    if building_path is not None:
+        energies['buildings'], stats['number_of_buildings'] = sum_building_profiles(building_path, building_unit, chunk_size)
+    if not energies:
+        raise ValueError('No building or sector profiles to aggregate')
+
+    # First timestamp and time step of every profile
+    firsts, steps = {}, {}
+    for sector in energies:
+        if sector in untimed:
+            longest = max(len(energies[name]) for name in untimed)
+            if longest % len(energies[sector]):
+                raise ValueError(f'The {len(energies[sector])} steps of the {sector} profile do not divide into '
+                                 f'the {longest} steps of the longest profile without timestamps')
+            firsts[sector] = pd.Timestamp(start)
+            steps[sector] = pd.Timedelta(hours=1/steps_per_hour) * (longest // len(energies[sector]))
+        else:
+            firsts[sector] = pd.Timestamp(timestamps[sector][0])
+            steps[sector] = profile_step(timestamps[sector], sector)
+    spans = {sector: (firsts[sector], firsts[sector] + len(energies[sector]) * steps[sector]) for sector in energies}
+    if len(set(spans.values())) > 1:
+        raise ValueError('The profiles cover different spans: ' + ', '.join(
+            f'{sector} from {first} to {end}' for sector, (first, end) in spans.items()))
+    step = min(steps.values())
+    for sector in energies:
+        if steps[sector] % step:
+            raise ValueError(f'The {steps[sector]} steps of the {sector} profile are not a multiple of {step}')
+    first, end = next(iter(spans.values()))
+    number_of_steps = (end - first) // step
+    steps_per_hour = pd.Timedelta(hours=1) / step
+
+    # MWh per step to MW
+    loads = pd.DataFrame(
+        {sector: align_steps(energy, number_of_steps) * steps_per_hour for sector, energy in energies.items()},
+        index=pd.date_range(first, periods=number_of_steps, freq=step, name=TIME_COLUMN)
+    )
+    loads['system'] = loads.sum(axis=1)
+
+    system = loads['system'].to_numpy()
+    stats['energy_MWh'] = system.sum(dtype=float) / steps_per_hour
+    stats['peak_MW'] = system.max()
+    stats['peak_step'] = loads.index[system.argmax()]
+    stats['load_factor'] = system.mean(dtype=float) / system.max()
+    for sector in energies:
+        stats[f'{sector}_share_of_peak'] = loads[sector].iat[system.argmax()] / system.max()
+    if supply is not None:
+        stats.update(gap_statistics(system, supply, steps_per_hour))
+    if output_path is not None:
+        write_profiles(loads, output_path)
+    return loads, load_duration_curve(system), stats
+
+if __name__ == '__main__':
+    # Sector outputs found in OUTPUT_DIR, buildings in OUTPUT_DIR/buildings.npy if present
+    sector_paths = {}
+    for sector, fname in [('industry', 'output_industry.csv'), ('transport', 'output_transport.parquet')]:
+        if os.path.exists(os.path.join(OUTPUT_DIR, fname)):
+            sector_paths[sector] = os.path.join(OUTPUT_DIR, fname)
+    building_path = os.path.join(OUTPUT_DIR, 'buildings.npy')
+    loads, ldc, stats = aggregate(
+        building_path if os.path.exists(building_path) else None,
+        sector_paths,
+        steps_per_hour=1,
+        start='2019-01-01',
+        output_path=os.path.join(OUTPUT_DIR, 'output_system.parquet')
+    )
+    for name, value in stats.items():
+        print(f'{name}: {value}')
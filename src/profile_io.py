@@ -0,0 +1,94 @@
+import os
+import numpy as np
+import pandas as pd
+
+# Load profiles of every sector (industry, EV, building) are stored as one typed timestamp column
+# followed by one float column per profile. The format is taken from the file extension.
+FORMATS = {'.parquet': 'parquet', '.arrow': 'arrow', '.feather': 'arrow', '.npz': 'npz', '.csv': 'csv'}
+TIME_COLUMN = 'Timestamp'
+
+# Format of a profile file from its extension
+#
+# path: profile file
+# fmt: one of parquet, arrow, npz, csv, overrides the extension if given
+def profile_format(path, fmt=None):
+    if fmt is not None:
+        return fmt
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in FORMATS:
+        raise ValueError(f'Unknown profile format for {path}, use one of {sorted(FORMATS)}')
+    return FORMATS[ext]
+
+# Write load profiles in a columnar format
+#
+# profiles: DataFrame indexed by a DatetimeIndex, one column per profile
+# path: output file, the format is taken from the extension unless fmt is given
+# fmt: parquet, arrow (Arrow IPC/Feather), npz or csv
+# dtype: dtype of the profile values, CSV keeps the values as they are
+# compression: codec of parquet (snappy, gzip, zstd, ...) and arrow (lz4, zstd) files, None for
+#   uncompressed files. Uncompressed Arrow IPC files are read back with zero copy.
+def write_profiles(profiles, path, fmt=None, dtype=np.float32, compression='zstd'):
+    if not isinstance(profiles.index, pd.DatetimeIndex):
+        raise TypeError('Load profiles must be indexed by a DatetimeIndex')
+    fmt = profile_format(path, fmt)
+    if fmt == 'csv':
+        profiles.rename_axis(TIME_COLUMN).to_csv(path)
+        return
+    profiles = profiles.astype(dtype)
+    if fmt == 'npz':
+        savez = np.savez if compression is None else np.savez_compressed
+        savez(path, **{TIME_COLUMN: profiles.index.to_numpy()},
+              **{column: profiles[column].to_numpy() for column in profiles.columns})
+        return
+    import pyarrow as pa
+    table = pa.Table.from_pandas(profiles.rename_axis(TIME_COLUMN).reset_index(), preserve_index=False)
+    if fmt == 'parquet':
+        import pyarrow.parquet as pq
+        pq.write_table(table, path, compression=compression or 'none')
+    elif fmt == 'arrow':
+        import pyarrow.feather as feather
+        feather.write_feather(table, path, compression=compression or 'uncompressed')
+    else:
+        raise ValueError(f'Unknown profile format {fmt}')
+
+# Read load profiles as arrays. Uncompressed Arrow IPC files are memory mapped and their columns
+# are returned without a copy, the other formats are decompressed or parsed once.
+#
+# path: profile file written by write_profiles
+# columns: profiles to read, all if None
+# fmt: parquet, arrow, npz or csv, taken from the extension if None
+# Returns the datetime64 timestamps and a dict of profile name to 1-D array
+def read_profile_arrays(path, columns=None, fmt=None):
+    fmt = profile_format(path, fmt)
+    if fmt == 'npz':
+        with np.load(path) as data:
+            names = [name for name in data.files if name != TIME_COLUMN] if columns is None else columns
+            return data[TIME_COLUMN], {name: data[name] for name in names}
+    if fmt == 'csv':
+        df = pd.read_csv(path, index_col=TIME_COLUMN, parse_dates=[TIME_COLUMN], usecols=None if columns is None else [TIME_COLUMN, *columns])
+        return df.index.to_numpy(), {name: df[name].to_numpy() for name in df.columns}
+    import pyarrow as pa
+    if fmt == 'parquet':
+        import pyarrow.parquet as pq
+        table = pq.read_table(path, columns=None if columns is None else [TIME_COLUMN, *columns])
+    elif fmt == 'arrow':
+        table = pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+        if columns is not None:
+            table = table.select([TIME_COLUMN, *columns])
+    else:
+        raise ValueError(f'Unknown profile format {fmt}')
+    arrays = {}
+    for name in table.column_names:
+        column = table.column(name)
+        column = column.chunk(0) if column.num_chunks == 1 else column.combine_chunks()
+        arrays[name] = column.to_numpy(zero_copy_only=False)
+    return arrays.pop(TIME_COLUMN), arrays
+
+# Read load profiles as a DataFrame indexed by timestamp
+#
+# path: profile file written by write_profiles
+# columns: profiles to read, all if None
+# fmt: parquet, arrow, npz or csv, taken from the extension if None
+def read_profiles(path, columns=None, fmt=None):
+    timestamps, arrays = read_profile_arrays(path, columns, fmt)
+    return pd.DataFrame(arrays, index=pd.DatetimeIndex(timestamps, name=TIME_COLUMN))
@@ -2,9 +2,15 @@ import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 import os
+import sys
 
 from distributions import EVData
 
+#The calendar is shared with the other sectors in src
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from calendar_index import day_index
+from profile_io import write_profiles
+
 class Algo:
 
     def __init__(
@@ -25,11 +31,20 @@ class Algo:
             duration_limit=0.5,
             charging_eff=0.90,
             weekday=True,
-            fig_dir="figures"
+            fig_dir="figures",
+            number_of_houses=None,
+            seed=None,
+            n_workers=1,
+            steps_per_hour=1,
+            number_of_days=1,
+            year=None
     ):
         """Class for computing the external algorithm
 
-
+        :param steps_per_hour (int): resolution of the charging profiles, e.g. 4 for 15 minutes
+        :param number_of_days (int): length of the rolling horizon, e.g. 365 for an annual profile
+        :param year (int): if given, the horizon starts on Jan 1 of this year and weekends and
+            holidays use the weekend profile, otherwise every day follows weekday
         """
         self.trip_csv = trip_csv
         self.init_soc_min = init_soc_min
@@ -48,6 +63,17 @@ class Algo:
         self.charging_eff = charging_eff
         self.weekday = weekday
         self.fig_dir = fig_dir
+        self.number_of_houses = number_of_houses
+        self.seed = seed
+        self.n_workers = n_workers
+        self.steps_per_hour = steps_per_hour
+        self.number_of_days = number_of_days
+        self.number_of_steps = 24*steps_per_hour*number_of_days
+        self.year = year
+
+        #independent random streams for the fleet sample and the charging decisions
+        self.sample_seed, charge_seed = np.random.SeedSequence(seed).spawn(2)
+        self.rng = np.random.default_rng(charge_seed)
 
         self.mileage_by_cartype = [107, 105, 289, 40]
         self.kwh_by_cartype = [30, 24, 100, 23]
@@ -77,100 +103,235 @@ class Algo:
         SampeleData = EVData(csv_file=self.trip_csv)
         if not load_model:
             SampeleData.fit(save_model=True)
-        df = SampeleData.inference(load_model=load_model, number_of_samples=self.number_of_samples)
+        if self.number_of_houses is None:
+            df = SampeleData.inference(load_model=load_model, number_of_samples=self.number_of_samples, seed=self.sample_seed)
+        else:
+            #sharded generation, identical for a given seed regardless of n_workers
+            df = SampeleData.inference_sharded(
+                number_of_houses=self.number_of_houses,
+                load_model=load_model,
+                seed=self.sample_seed,
+                n_workers=self.n_workers
+            )
         return df
 
     def run(
         self,
-        weekday=True
+        weekday=None,
+        plot_cars=False,
+        per_car=False
     ):
-        """Method to run the algorithm
+        """Method to run the algorithm for all cars over the horizon
 
+        Every day of the horizon reuses the sampled trips with new SOC and threshold draws. Trips
+        are grouped by car once and the SOC, charging decisions, start times and durations are
+        computed as arrays. The energy of every charging event is split over the intervals it
+        overlaps, and sessions running past midnight carry into the next day; the horizon wraps
+        around, so the last night charges into the first day. Each day only touches the window of
+        intervals its events overlap, which is accumulated into the preallocated profiles.
+
+        :param weekday (bool, np.array): use the weekday residential profile, either for all days
+            or as a (number_of_days, ) array, defaults to the calendar of self.year if given or
+            to self.weekday
+        :param plot_cars (bool): plot the home charging schedule of every charging car, implies
+            per_car
+        :param per_car (bool): keep the (cars x number_of_steps) home and public profiles, only
+            the aggregate profiles are accumulated otherwise
+        :return agg_transportation_profile (np.array): (number_of_steps, ) aggregated charging
+            energy in each interval
         """
-        car_ids = np.unique(self.df_sample["carid"].values)
-        #initialize the two sectors
-        agg_transportation_profile = np.zeros(24)
-        #Store the consumption information by car id
-
-        res_energy_data = []
-        res_schedule_data = []
-        for id in car_ids:
-            df_s = self.df_sample.loc[self.df_sample["carid"] == id]
-            init_SOC = np.random.uniform(low=self.init_soc_min, high=self.init_soc_max)  # initial SOC
-            #print(df_s.columns)
-            start_times = df_s.loc[:, "carid"].values
-            duration = df_s.loc[:, "duration"].values
-            mileages = df_s.loc[:, "mileages"].values
-            cartypes = df_s.loc[:, "cartype"].values
-
-            #initialize array informtion
-            homecharge_by_carid = None
-            consumption_per_car = np.zeros(24)
-            #print(f"start_times: {start_times}")
-            for tr, st in enumerate(start_times):
-                SOC = (init_SOC*self.mileage_by_cartype[int(cartypes[tr]) - 1] - mileages[tr])/self.mileage_by_cartype[int(cartypes[tr]) - 1]
-                remaining_Mileage = SOC*self.mileage_by_cartype[int(cartypes[tr]) - 1]
-                #stochastically compute the threshold limit
-                soc_threshold = np.random.uniform(low=self.soc_threshold_min, high=self.soc_threshold_max)
-                #initialize a temporary array
-                #charging in public scenarios
-                if (remaining_Mileage < mileages[tr]/2) and (mileages[tr]/duration[tr] < self.public_speed_limit and duration[tr] > self.duration_limit):
-                    charge_time_start = round(start_times[tr] + 0.5*mileages[tr]/self.avg_rt_speed)
-                    charge_time_start = charge_time_start - 24 if charge_time_start > 24 else charge_time_start
-                    charge_start_idx = charge_time_start - 1 if charge_time_start > 0 else 0 #-1 because python indexing starts at 0
-                    site_power, schedule = self.compute_energy_consumption(charge_start_idx, int(cartypes[tr])-1, soc_threshold, False)
-                    agg_transportation_profile += schedule
-                elif SOC < soc_threshold: #charging at home case
-                    trip_end_time = st + duration[tr] #end time of the tri
-                    trip_end_time = trip_end_time - 24 if trip_end_time > 24 else trip_end_time
-                    end_time_idx = int(np.floor(trip_end_time)) - 1
-                    #select profile based on weekday or a weekday or a weekend, compute the gradient
-                    grad = self.residence_weekday_diff.copy() if weekday else self.residence_weekend_diff.copy()
-                    #Get the gradient after the end time is complete
-                    grad_from_idx = grad[end_time_idx:] if np.any(grad[end_time_idx:]) else grad
-                    #Note from Aowanin: Incorporating stochasticity in start time
-                    charge_time_start = np.where(grad_from_idx)[0][0] + end_time_idx if np.any(grad[end_time_idx:]) else np.where(grad_from_idx)[0][0]#select the first timestep
-                    site_power, schedule = self.compute_energy_consumption(charge_time_start, int(cartypes[tr]) - 1,
-                                                                           soc_threshold, False)
-                    consumption_per_car += schedule
-                    #homecharge_by_carid = schedule[:, None] if homecharge_by_carid is None else np.concat((homecharge_by_carid, schedule[:, None]), axis=1)
-                    # print(f"homecharge by carid: ")
-                    # print(homecharge_by_carid)
-                    #plotting
-                    #find the start time based on the existing NW Council profile
-                else:
-                    pass
-            #collect the schedule and the site power data into a list
-            home_schedule = (consumption_per_car > 0).astype(int)
-            print(f"home schedule: {home_schedule}")
-            res_energy_data.append()
-            #plot by car
-            if np.any(consumption_per_car) > 0:
-                #print(f"consumption per car:  {consumption_per_car}")
-                filename = f"schedule_car_{int(id)}.svg"
-                self.plot(schedule=consumption_per_car, filename=filename)
-        #print(f"agg_profile: {agg_transportation_profile}")
+        if weekday is None:
+            weekday = self.calendar_weekdays() if self.year is not None else self.weekday
+        weekday = np.broadcast_to(weekday, (self.number_of_days,))
+        per_car = per_car or plot_cars
+
+        #group trips once, car_idx maps every trip to its row in the output matrices
+        car_ids, car_idx = np.unique(self.df_sample["carid"].values, return_inverse=True)
+        start_times = self.df_sample["start_times"].values
+        duration = self.df_sample["duration"].values
+        mileages = self.df_sample["mileages"].values
+        cartype_idx = self.df_sample["cartype"].values.astype(int) - 1
+        n_cars = len(car_ids)
+        n_trips = len(start_times)
+        car_mileage = np.asarray(self.mileage_by_cartype)[cartype_idx]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            avg_speed = mileages/duration
+
+        n_rows = n_cars if per_car else 1
+        public_profile = np.zeros((n_rows, self.number_of_steps))
+        home_profile = np.zeros((n_rows, self.number_of_steps))
+        for day in range(self.number_of_days):
+            #SOC after each trip, starting from a random initial SOC per car
+            init_SOC = self.rng.uniform(low=self.init_soc_min, high=self.init_soc_max, size=n_cars)[car_idx]
+            SOC = (init_SOC*car_mileage - mileages)/car_mileage
+            remaining_Mileage = SOC*car_mileage
+            #stochastically compute the threshold limit
+            soc_threshold = self.rng.uniform(low=self.soc_threshold_min, high=self.soc_threshold_max, size=n_trips)
+
+            #charging in public scenarios, halfway along the trip
+            public = (remaining_Mileage < mileages/2) & (avg_speed < self.public_speed_limit) & (duration > self.duration_limit)
+            public_start = 24*day + start_times + 0.5*mileages/self.avg_rt_speed
+            #charging at home case
+            home = ~public & (SOC < soc_threshold)
+            home_start = 24*day + self.home_charge_start(start_times + duration, weekday[day])
+
+            self.compute_energy_consumption(
+                public_start[public], cartype_idx[public], soc_threshold[public],
+                car_idx[public] if per_car else None, n_rows, False, out=public_profile
+            )
+            self.compute_energy_consumption(
+                home_start[home], cartype_idx[home], soc_threshold[home],
+                car_idx[home] if per_car else None, n_rows, False, out=home_profile
+            )
+
+        self.car_ids = car_ids
+        self.public_profile = public_profile if per_car else None
+        self.home_profile = home_profile if per_car else None
+        self.agg_public_profile = public_profile.sum(axis=0)
+        self.agg_home_profile = home_profile.sum(axis=0)
+
+        #plot by car
+        if plot_cars:
+            for id, consumption_per_car in zip(car_ids, home_profile):
+                if np.any(consumption_per_car > 0):
+                    self.plot(schedule=consumption_per_car, filename=f"schedule_car_{int(id)}.svg")
+
+        agg_transportation_profile = self.agg_public_profile + self.agg_home_profile
         self.plot(agg_transportation_profile)
-        return None
+        return agg_transportation_profile
+
+    def save_profiles(self, path, start=None, fmt=None, compression="zstd"):
+        """Method to write the aggregated public, home and total charging profiles of the last run
+
+        The profiles are stored with typed timestamps, as float32 columns in a Parquet, Arrow IPC
+        or npz file, or as a CSV file, in the same layout as the other sector profiles.
+
+        :param path (str): output file, the format is taken from the extension
+        :param start (str, pd.Timestamp): start of the horizon, defaults to Jan 1 of self.year
+        :param fmt (str): parquet, arrow, npz or csv, overrides the extension
+        :param compression (str): codec of a binary file, see profile_io.write_profiles, None for
+            uncompressed files, which are read back with zero copy from Arrow IPC
+        """
+        if start is None:
+            if self.year is None:
+                raise ValueError("start is required when the Algo has no year")
+            start = f"{self.year}-01-01"
+        timestamps = pd.date_range(start, periods=self.number_of_steps, freq=pd.Timedelta(hours=1/self.steps_per_hour))
+        profiles = pd.DataFrame({
+            "Public Charging [kWh]": self.agg_public_profile,
+            "Home Charging [kWh]": self.agg_home_profile,
+            "Total Charging [kWh]": self.agg_public_profile + self.agg_home_profile
+        }, index=timestamps)
+        write_profiles(profiles, path, fmt=fmt, compression=compression)
+
+    def calendar_weekdays(self):
+        """
+        Method to flag the working days of the horizon from the calendar of self.year, the
+        horizon continues into the following years if it is longer than a year
+
+        """
+        weekday = []
+        year = self.year
+        while len(weekday) < self.number_of_days:
+            days = day_index(year)
+            weekday.extend(~(days["is_weekend"].values | days["is_holiday"].values))
+            year += 1
+        return np.array(weekday[:self.number_of_days])
+
+    def home_charge_start(self, trip_end_time, weekday=True):
+        """
+        Method to compute the home charging start time, in hours from the start of the trip day
+
+        Charging starts at the first increase of the residential profile at or after the hour the
+        trip ends, or at the first increase of the next day if there is none, and never before the
+        car is back home.
+
+        """
+        day_offset = 24*np.floor(trip_end_time/24)
+        end_time_idx = np.clip(np.floor(trip_end_time - day_offset).astype(int) - 1, 0, None)
+        #select profile based on weekday or a weekday or a weekend, compute the gradient
+        grad = self.residence_weekday_diff if weekday else self.residence_weekend_diff
+        charge_time_start = self.next_increase(grad)[np.minimum(end_time_idx, len(grad) - 1)]
+        charge_time_start = np.where(charge_time_start < end_time_idx, charge_time_start + 24, charge_time_start)
+        return np.maximum(day_offset + charge_time_start, trip_end_time)
+
+    @staticmethod
+    def next_increase(grad):
+        """
+        Method to find, for every hour, the first hour at or after it where the profile increases,
+        wrapping around to the first increase of the day if there is none
+
+        """
+        increase = np.flatnonzero(grad)
+        pos = np.searchsorted(increase, np.arange(len(grad)))
+        return np.where(pos < len(increase), increase[np.minimum(pos, len(increase) - 1)], increase[0])
 
     def compute_energy_consumption(
             self,
             charge_time_start,
             cartype_idx,
             soc_min,
-            bldg_sch=True
+            car_idx=None,
+            number_of_cars=1,
+            bldg_sch=True,
+            out=None
     ):
         """
-        Method to compute energy consumption at site
+        Method to compute energy consumption at site for a batch of charging events
 
+        Each event charges at charging_rate from charge_time_start until its energy is delivered.
+        The energy is split over the intervals of the horizon in proportion to the time charged
+        in each, and events running past the end of the horizon wrap around to its start.
+
+        :param charge_time_start (np.array): (n, ) start time of each event in hours from the
+            start of the horizon
+        :param cartype_idx (np.array): (n, ) car type index of each charging event
+        :param soc_min (np.array): (n, ) SOC at the start of each charging event
+        :param car_idx (np.array): (n, ) row of the car in the output schedule, None to aggregate
+            all events in a single row
+        :param number_of_cars (int): number of rows in the output schedule
+        :param out (np.array): (number_of_cars, number_of_steps) schedule the energy is added to,
+            only the window of intervals overlapped by the events is computed
+        :return site_power (np.array), schedule (np.array): (n, ) energy of each event and the
+            (number_of_cars, number_of_steps) charging schedule, out if given
         """
-        schedule = np.zeros(24)
-        soc_max = np.random.uniform(low=self.soc_upper_max, high=self.soc_upper_min)
-        site_power = self.kwh_by_cartype[cartype_idx]*self.charging_eff*(soc_max - soc_min)
+        dt = 1/self.steps_per_hour
+        soc_max = self.rng.uniform(low=self.soc_upper_min, high=self.soc_upper_max, size=len(charge_time_start))
+        site_power = np.asarray(self.kwh_by_cartype)[cartype_idx]*self.charging_eff*(soc_max - soc_min)
         charge_duration = site_power/self.charging_rate
-        charge_time_end = round(charge_time_start + charge_duration)
-        charge_time_end = charge_time_end - 24 if charge_time_end > 24 else charge_time_end
-        schedule[charge_time_start: charge_time_end] = site_power if not bldg_sch else 1
+        charge_time_end = charge_time_start + charge_duration
+
+        #expand every event into the intervals it overlaps
+        first_step = np.floor(charge_time_start/dt).astype(int)
+        n_steps = np.clip(np.ceil(charge_time_end/dt).astype(int) - first_step, 0, None)
+        event = np.repeat(np.arange(len(charge_time_start)), n_steps)
+        step = first_step[event] + np.arange(len(event)) - np.repeat(np.cumsum(n_steps) - n_steps, n_steps)
+        overlap = np.minimum(charge_time_end[event], (step + 1)*dt) - np.maximum(charge_time_start[event], step*dt)
+        energy = self.charging_rate*overlap if not bldg_sch else np.ones_like(overlap)
+
+        row = np.zeros_like(event) if car_idx is None else car_idx[event]
+        if out is not None:
+            assert not bldg_sch
+            if len(step) == 0:
+                return site_power, out
+            #scatter-add the energy into the window of intervals, then add the window to the
+            #schedule, wrapping around the horizon
+            first = step.min()
+            width = step.max() - first + 1
+            window = np.bincount(row*width + step - first, weights=energy, minlength=number_of_cars*width)
+            window = window.reshape(number_of_cars, width)
+            for start in range(0, width, self.number_of_steps):
+                chunk = window[:, start:start + self.number_of_steps]
+                cols = (first + start + np.arange(chunk.shape[1])) % self.number_of_steps
+                out[:, cols] += chunk
+            return site_power, out
+
+        #scatter-add the energy into the schedule, wrapping around the horizon
+        flat_idx = row*self.number_of_steps + step % self.number_of_steps
+        schedule = np.bincount(flat_idx, weights=energy, minlength=number_of_cars*self.number_of_steps)
+        schedule = schedule.reshape(number_of_cars, self.number_of_steps)
+        if bldg_sch:
+            schedule = (schedule > 0).astype(int)
         return site_power, schedule
 
     def plot(
@@ -183,7 +344,7 @@ class Algo:
         if not os.path.exists(self.fig_dir):
             os.makedirs(self.fig_dir)
 
-        t = np.arange(schedule.shape[0])
+        t = np.arange(schedule.shape[0])/self.steps_per_hour
         plt.plot(t, schedule, 'k-')
         plt.xlabel(xlabel)
         plt.ylabel(ylabel)
@@ -0,0 +1,85 @@
+"""
+Benchmark of the EVData preprocessing stage (get_deta, add_trip_frequency, get_number_of_trips,
+get_car_per_house_dist) on synthetic trip files from 10k to 10M rows.
+
+Usage: python benchmark_preprocess.py [max_rows]
+"""
+import os
+import sys
+import time
+import tempfile
+import numpy as np
+import pandas as pd
+
+from distributions import EVData
+
+# Number of trip rows for each benchmark run
+SIZES = [10_000, 100_000, 1_000_000, 10_000_000]
+
+# Rough NHTS-like shape of the synthetic data
+TRIPS_PER_CAR = 3
+CARS_PER_HOUSE = 2
+
+
+def make_trips(n_rows, csv_file, seed=0):
+    """
+    Writes a synthetic trips.csv with n_rows trips, with the columns read by EVData.
+    """
+    rng = np.random.default_rng(seed)
+    carid = np.sort(rng.integers(0, n_rows//TRIPS_PER_CAR + 1, size=n_rows)) + 1
+    start = rng.uniform(5, 22, size=n_rows)
+    duration = rng.gamma(2, 0.2, size=n_rows)
+    df = pd.DataFrame({
+        "houseid": carid//CARS_PER_HOUSE + 1,
+        "carid": carid,
+        "cartype": rng.integers(1, 5, size=n_rows),
+        "start": start,
+        "end": start + duration,
+        "mileage": duration*rng.uniform(15, 45, size=n_rows)
+    })
+    df.to_csv(csv_file, index=False)
+
+
+def time_stages(csv_file, model_dir):
+    """
+    Times each preprocessing stage, in seconds. Categorical fits are cheap compared to the
+    grouped aggregations, so they are included in their stage.
+    """
+    data = EVData(csv_file=csv_file, model_dir=model_dir)
+    timings = {}
+
+    tic = time.perf_counter()
+    data.df, data.mileage, data.start_time, data.duration, data.car_type, data.houseid = data.get_deta()
+    timings["get_deta"] = time.perf_counter() - tic
+
+    tic = time.perf_counter()
+    data.add_trip_frequency()
+    timings["add_trip_frequency"] = time.perf_counter() - tic
+
+    tic = time.perf_counter()
+    data.get_number_of_trips()
+    timings["get_number_of_trips"] = time.perf_counter() - tic
+
+    tic = time.perf_counter()
+    data.get_car_per_house_dist()
+    timings["get_car_per_house_dist"] = time.perf_counter() - tic
+
+    return timings
+
+
+if __name__ == "__main__":
+    max_rows = int(sys.argv[1]) if len(sys.argv) > 1 else SIZES[-1]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        rows = []
+        for n_rows in [size for size in SIZES if size <= max_rows]:
+            csv_file = os.path.join(tmp_dir, f"trips_{n_rows}.csv")
+            make_trips(n_rows, csv_file)
+            timings = time_stages(csv_file, os.path.join(tmp_dir, "saved_dist"))
+            timings["rows"] = n_rows
+            rows.append(timings)
+            os.remove(csv_file)
+
+    results = pd.DataFrame(rows).set_index("rows")
+    results["total"] = results.sum(axis=1)
+    print(results.round(3).to_string())
@@ -1,12 +1,21 @@
-from scipy import stats
+#distfit, scipy and matplotlib are only imported when fitting or plotting, so that sampling
+#from compiled inverse-CDF tables only requires numpy and pandas
 #from fitter import Fitter
-from distfit import distfit
 import numpy as np
 import pandas as pd
 import os
-import matplotlib.pyplot as plt
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+
+#Version of the model bundle layout, bundles saved with another version are rejected on load
+MODEL_VERSION = 2
+BUNDLE_NAME = "ev_model.npz"
+
+#Shortlist of distfit candidates for refits, covers the distributions selected on the NHTS data
+SHORTLIST = ["norm", "expon", "gamma", "lognorm", "weibull_min", "beta", "pareto", "t"]
 
 def test():
+    from distfit import distfit
 
     # data = stats.gamma.rvs(2, loc=1.5, scale=2, size=10000)
     # f = Fitter(data)
@@ -32,41 +41,162 @@ class EVData:
     ):
         """Method to generate distributions
 
+        The trip data is only read when fitting, inference from a saved model bundle never reads
+        csv_file.
 
         """
         self.csv_file = csv_file
         self.model_dir = model_dir
         self.mileage_by_cartype = [107,105,289,40]
-        self.upper_avg_spped = upper_avg_speed
+        self.upper_avg_speed = upper_avg_speed
+        self.bundle_file = os.path.join(self.model_dir, BUNDLE_NAME)
+        self.df = None
 
         if  not os.path.exists(self.model_dir):
             os.makedirs(self.model_dir)
 
-        self.df, self.mileage, self.start_time, self.duration, self.car_type, self.houseid = self.get_deta()
-        self.add_trip_frequency()
+    def load_data(self):
+        """Method to read and preprocess the trip data, once
+
+        """
+        if self.df is None:
+            self.df, self.mileage, self.start_time, self.duration, self.car_type, self.houseid = self.get_deta()
+            self.add_trip_frequency()
+        return None
+
+    def fit(self, save_model=False, n_workers=1, candidates=None, subsample=None, seed=None):
+        """Method to fit all distributions
 
-    def fit(self, save_model=False):
+        :param n_workers (int): number of processes for the duration and mileage fits
+        :param candidates (list): distfit distributions to search for duration and mileage, e.g.
+            SHORTLIST, all of distfit's defaults if None
+        :param subsample (int): search the candidates on a subsample of this size and refit only
+            the best one on the full data
+        :param seed (int): seed for the subsamples
+        """
+        self.load_data()
         #fist get the number of trips
         self.TripDist = self.get_number_of_trips()
         self.HouseDist = self.get_car_per_house_dist()
         self.StartTimeDist, self.CarTypeDist = self.get_ind_distribution(save_model=save_model)
-        self.list_of_DurationDist, self.list_of_MileageDist, _, _ = self.get_dep_distribution(save_model=save_model)
+        self.TripModel = self.get_trip_model()
+        self.list_of_DurationDist, self.list_of_MileageDist, _, _ = self.get_dep_distribution(
+            save_model=save_model,
+            n_workers=n_workers,
+            candidates=candidates,
+            subsample=subsample,
+            seed=seed
+        )
+
+        if save_model:
+            self.save_model()
 
         return None
 
+    def save_model(self):
+        """Method to save all fitted distributions in a single versioned bundle
+
+        The bundle holds the categorical probabilities, the compiled inverse-CDF tables, the
+        joint trip model, the car types and the SHA-256 of the trip data they were fitted on.
+
+        """
+        arrays = {
+            "version": np.array(MODEL_VERSION),
+            "source_hash": np.array(self.source_hash()),
+            "cartypes": self.cartypes
+        }
+        dists = {
+            "TripDist": self.TripDist,
+            "HouseDist": self.HouseDist,
+            "StartTimeDist": self.StartTimeDist,
+            "CarTypeDist": self.CarTypeDist
+        }
+        for ct, DurationDist, MileageDist in zip(self.cartypes, self.list_of_DurationDist, self.list_of_MileageDist):
+            dists[f"DurationDist_{ct}"] = DurationDist
+            dists[f"MileageDist_{ct}"] = MileageDist
+
+        dists["TripModel"] = self.TripModel
+
+        for name, dist in dists.items():
+            for key, value in dist.to_arrays().items():
+                arrays[f"{name}.{key}"] = value
+
+        np.savez(self.bundle_file, **arrays)
+        return None
+
+    def load_model(self, check_source=False):
+        """Method to load all distributions from the model bundle
+
+        :param check_source (bool): raise if csv_file no longer matches the hash in the bundle,
+            this is the only case where the trip data is read
+        """
+        if not os.path.exists(self.bundle_file):
+            raise FileNotFoundError(f"{self.bundle_file} not found, run fit(save_model=True) first")
+
+        with np.load(self.bundle_file) as bundle:
+            arrays = {key: bundle[key] for key in bundle.files}
+
+        if int(arrays.pop("version")) != MODEL_VERSION:
+            raise ValueError(f"{self.bundle_file} was saved with another model version, refit the model")
+        source_hash = str(arrays.pop("source_hash"))
+        if check_source and source_hash != self.source_hash():
+            raise ValueError(f"{self.csv_file} changed since {self.bundle_file} was saved, refit the model")
+        self.cartypes = arrays.pop("cartypes")
+
+        #group arrays by distribution name
+        dists = {}
+        for key, value in arrays.items():
+            name, field = key.rsplit(".", 1)
+            dists.setdefault(name, {})[field] = value
+        self.TripModel = TripModel.from_arrays(dists.pop("TripModel"))
+        dists = {name: Distribution.from_arrays(fields) for name, fields in dists.items()}
+
+        self.TripDist = dists["TripDist"]
+        self.HouseDist = dists["HouseDist"]
+        self.StartTimeDist = dists["StartTimeDist"]
+        self.CarTypeDist = dists["CarTypeDist"]
+        self.list_of_DurationDist = [dists[f"DurationDist_{ct}"] for ct in self.cartypes]
+        self.list_of_MileageDist = [dists[f"MileageDist_{ct}"] for ct in self.cartypes]
+        return None
+
+    def source_hash(self):
+        """Method to compute the SHA-256 of the trip data
+
+        """
+        sha = hashlib.sha256()
+        with open(self.csv_file, "rb") as file:
+            for chunk in iter(lambda: file.read(1 << 20), b""):
+                sha.update(chunk)
+        return sha.hexdigest()
+
     def inference(
             self,
             number_of_samples=10,
             load_model=False,
             max_iter=50,
-            number_of_houses=None
+            number_of_houses=None,
+            seed=None,
+            joint=True,
+            verbose=True
     ):
+        """Method to generate a synthetic fleet of trips
+
+        All cars are sampled at once as NumPy arrays. With joint=True, durations and mileages come
+        from the joint TripModel and are feasible by construction. Otherwise they are sampled
+        independently and only the trips that violate the time window or the average speed limit
+        are redrawn, up to max_iter times; trips that are still infeasible are assigned a zero
+        duration and mileage. The number of infeasible trips is stored in self.infeasible_trips.
+
+        :param number_of_samples (int): number of cars, ignored if number_of_houses is given
+        :param number_of_houses (int): number of houses to generate cars for
+        :param seed (int, np.random.SeedSequence, np.random.Generator): seed for reproducible sampling
+        :param joint (bool): sample durations and mileages from the joint TripModel
+        :param verbose (bool): print the number of infeasible trips
+        :return df_out (pd.DataFrame): one row per trip
+        """
         #loading all distribution objects
         if load_model:
-            self.TripDist = self.get_number_of_trips()
-            self.HouseDist = self.get_car_per_house_dist()
-            self.StartTimeDist, self.CarTypeDist = self.get_ind_distribution(load_model=True)
-            self.list_of_DurationDist, self.list_of_MileageDist, duration_names, mileage_names  = self.get_dep_distribution(load_model=True)
+            self.load_model()
 
         assert hasattr(self, "TripDist")
         assert hasattr(self, "StartTimeDist")
@@ -75,120 +205,194 @@ class EVData:
         assert hasattr(self, "list_of_DurationDist")
         assert hasattr(self, "list_of_MileageDist")
 
+        rng = np.random.default_rng(seed)
+
         #first infer the number of cars per house
         if number_of_houses is not None:
-            cars_per_house = self.HouseDist.sample(N=number_of_houses)
-            cummulative_cars = np.cumsum(cars_per_house)
-            # print(f"cars per house: {cars_per_house}")
-            # print(f"Cars per house: {cummulative_cars}")
+            cars_per_house = np.asarray(self.HouseDist.sample(N=number_of_houses, rng=rng), dtype=int)
+            #overwrite number of samples if number of houses is provided
+            number_of_samples = int(np.sum(cars_per_house))
+
+        #per car variables
+        number_of_trips = np.asarray(self.TripDist.sample(N=number_of_samples, rng=rng), dtype=int)
+        number_of_cartypes = np.asarray(self.CarTypeDist.sample(N=number_of_samples, rng=rng), dtype=int)
+
+        #per trip variables, trips of the same car are contiguous
+        n_total = int(np.sum(number_of_trips))
+        car_idx = np.repeat(np.arange(number_of_samples), number_of_trips)
+        ctype = number_of_cartypes[car_idx]
+        type_idx = np.searchsorted(self.cartypes, ctype) #index to locate the duration and milage objs
+        trip_idx = np.arange(n_total) - np.repeat(np.cumsum(number_of_trips) - number_of_trips, number_of_trips)
+
+        #start times within the day, sorted in ascending order for each car
+        start_times, _ = self.rejection_sample(
+            draw=lambda rows: self.StartTimeDist.sample(N=len(rows), rng=rng),
+            accept=lambda x, rows: (x > 0) & (x < 24),
+            size=n_total,
+            max_iter=max_iter
+        )
+        start_times = start_times[np.lexsort((start_times, car_idx))]
 
-            #overwrite number of samples if number of cars is provided
-        else:
-            cars_per_house = None
+        #decide on the upper and lower bounds when sampling
+        is_last = trip_idx == number_of_trips[car_idx] - 1
+        min_val = np.where(trip_idx == 0, 0, start_times)
+        max_val = np.where(is_last, 24, np.append(start_times[1:], 24))
 
-        number_of_samples = np.sum(cars_per_house) if cars_per_house is not None else number_of_samples
+        if joint:
+            #durations truncated to the time left before the next trip
+            durations, mileages, infeasible = self.TripModel.sample(
+                ctype, trip_idx, max_val - start_times, rng, upper_avg_speed=self.upper_avg_speed
+            )
+        else:
+            durations, dur_ok = self.rejection_sample(
+                draw=lambda rows: self.sample_by_cartype(self.list_of_DurationDist, type_idx[rows], rng),
+                accept=lambda x, rows: (start_times[rows] + x > min_val[rows]) & (start_times[rows] + x < max_val[rows]) & (x > 0),
+                size=n_total,
+                max_iter=max_iter
+            )
 
-        #first infer the number of cars per house
-        #now that wee have loaded all the modules, we can start generating the
-        number_of_trips = self.TripDist.sample(N=number_of_samples)
-        number_of_cartypes = self.CarTypeDist.sample(N=number_of_samples)
+            mileages, mil_ok = self.rejection_sample(
+                draw=lambda rows: self.sample_by_cartype(self.list_of_MileageDist, type_idx[rows], rng),
+                accept=lambda x, rows: (x > 0) & (x/durations[rows] < self.upper_avg_speed),
+                size=n_total,
+                max_iter=max_iter
+            )
 
+            #trips that could not be sampled within max_iter
+            infeasible = ~(dur_ok & mil_ok)
+            durations[infeasible] = 0
+            mileages[infeasible] = 0
+
+        self.infeasible_trips = int(np.sum(infeasible))
+        if verbose and self.infeasible_trips > 0:
+            print(f"{self.infeasible_trips} of {n_total} trips were infeasible")
+
+        #Export data to pd dataframe
+        df_out = pd.DataFrame()
+        df_out["carid"] = (car_idx + 1).astype(float)
+        df_out["cartype"] = ctype.astype(float)
+        df_out["start_times"] = start_times
+        df_out["duration"] = durations
+        df_out["end_time"] = durations + start_times
+        df_out["mileages"] = mileages
+
+        #adding house_id to the dataframe
         if number_of_houses is not None:
-            house_id = np.zeros_like(number_of_trips)
-            for i in range(number_of_houses):
-                start_idx = 0 if i == 0 else cummulative_cars[i-1]
-                house_id[start_idx: cummulative_cars[i]] = i + 1
-
-        print(f"house id: {house_id}")
-        print(f"Number of samples: ")
-        df_list = [] #initialize empty ddataframe
-        carid = 0
-        #add missed tries
-        #check inference for start times
-        for n_car, (n_trips, ct) in enumerate(zip(number_of_trips, number_of_cartypes)):
-            #include
-            _check_bool = False
-            _st_bool = False
-            _dur_bool = False
-            _mil_bool = False
-            #TODO: Create end_times
-            for iter in range(max_iter):
-                start_times = self.StartTimeDist.sample(N=n_trips) #generte start times equal to the number of trips
-                if np.all(start_times) > 0 and np.all(start_times) <24:
-                    _st_bool = True
-                    break
-            #rearrange array in ascenting order
-            start_times.sort()
-            print(f"start_times: {start_times}")
-            durations = np.zeros_like(start_times)
-            mileages = np.zeros_like(start_times)
-            carid += 1
-            for n in range(n_trips):
-                idx = ct - 1 #index to locate the duration and milage objs
-                DurationDist = self.list_of_DurationDist[idx]
-                MileageDist = self.list_of_MileageDist[idx]
-                #decide on the upper and lower bounds when sampling
-                min_val = 0 if n == 0 else start_times[n]
-                max_val = 24 if n == n_trips - 1 else start_times[n+1]
-                dur = -0.001 #assign duration to be a negative value
-                mil = -0.001
-                #asssign duration based on the sample
-                for iter in range(max_iter):
-                #while (start_times[n] + dur <=  min_val) or (start_times[n] + dur >= max_val) or dur < 0:
-                    dur = DurationDist.sample()[0]
-                    print(f"dur: {dur}")
-                    if (start_times[n] + dur > min_val) and (start_times[n] + dur < max_val) and dur > 0:
-                        _dur_bool = True
-                        break
-
-                #while mil <= 0:
-                for iter in range(max_iter):
-                    mil = MileageDist.sample()[0]
-                    print(f"mil: {mil}")
-                    if mil > 0 and (mil/dur) < self.upper_avg_spped:
-                        durations[n] = dur
-                        mileages[n] = mil
-                        _mil_bool = True
-                        break
-
-            print(f"start times: {start_times}")
-            print(f"durations: {durations}")
-            print(f"mileages: {mileages}")
-
-            #assert _st_bool and _mil_bool and _dur_bool
-
-            ###Troubleshoot
-            ctype = ct*np.ones_like(start_times)
-            carid_arr = carid*np.ones_like(start_times)
-
-            #Export data to pd dataframe
-            df = pd.DataFrame()
-            df["carid"] = carid_arr
-            df["cartype"] = ctype
-            df["start_times"] = start_times
-            df["duration"] = durations
-            df["end_time"] = durations + start_times
-            df["mileages"] = mileages
-
-            #adding house_id to the dataframe
-            if number_of_houses is not None:
-                df["house_id"] = house_id[n_car]*np.ones_like(start_times)
-
-
-            #add in the
-
-            df_list.append(df)
+            house_id = np.repeat(np.arange(1, number_of_houses + 1), cars_per_house)
+            df_out["house_id"] = house_id[car_idx].astype(float)
+
+        return df_out
+
+    def inference_sharded(
+            self,
+            number_of_houses,
+            load_model=False,
+            max_iter=50,
+            seed=None,
+            n_workers=1,
+            houses_per_shard=10000
+    ):
+        """Method to generate the fleet for many houses in independent shards
+
+        Houses are split into shards of houses_per_shard, each sampled with its own child of
+        np.random.SeedSequence(seed). The shards do not depend on n_workers, so the output is
+        identical for a given seed however many processes are used.
+
+        :param number_of_houses (int): total number of houses
+        :param n_workers (int): number of processes, shards run in this process if 1
+        :param houses_per_shard (int): number of houses sampled by each shard
+        :return df_out (pd.DataFrame): one row per trip, with unique carid and house_id
+        """
+        if load_model:
+            self.load_model()
+
+        n_shards = int(np.ceil(number_of_houses/houses_per_shard))
+        shard_houses = [min(houses_per_shard, number_of_houses - k*houses_per_shard) for k in range(n_shards)]
+        seed = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+        shard_seeds = seed.spawn(n_shards)
+        shard_args = [(n, shard_seed, max_iter) for n, shard_seed in zip(shard_houses, shard_seeds)]
+
+        if n_workers > 1:
+            with ProcessPoolExecutor(
+                    max_workers=n_workers,
+                    initializer=_init_shard_worker,
+                    initargs=(self,)
+            ) as executor:
+                results = list(executor.map(_inference_shard, shard_args))
+        else:
+            _init_shard_worker(self)
+            results = [_inference_shard(args) for args in shard_args]
+        df_list = [df for df, _ in results]
+
+        #infeasible trips of all shards, reported once
+        self.infeasible_trips = sum(infeasible for _, infeasible in results)
+        if self.infeasible_trips > 0:
+            print(f"{self.infeasible_trips} of {sum(len(df) for df in df_list)} trips were infeasible")
+
+        #offset car and house ids by the cars and houses of the previous shards
+        car_offset = 0
+        for n_houses, df in zip(np.cumsum([0] + shard_houses[:-1]), df_list):
+            n_cars = df["carid"].max()
+            df["carid"] += car_offset
+            df["house_id"] += n_houses
+            car_offset += n_cars
 
         df_out = (pd.concat(df_list)).reset_index(drop=True)
         return df_out
 
+    def __getstate__(self):
+        """Drop the raw trip data when pickling, shard workers only need the distributions
+
+        """
+        state = self.__dict__.copy()
+        for key in ["df", "mileage", "start_time", "duration", "car_type", "houseid"]:
+            state.pop(key, None)
+        return state
+
+    @staticmethod
+    def rejection_sample(draw, accept, size, max_iter=50):
+        """Method to sample an array, redrawing only the rows that fail the constraints
+
+        :param draw (callable): draw(rows) returns one sample for each row index in rows
+        :param accept (callable): accept(x, rows) returns a boolean mask of valid samples
+        :param size (int): number of rows
+        :param max_iter (int): maximum number of draws for each row
+        :return samples (np.array), valid (np.array): samples and mask of accepted rows
+        """
+        samples = np.zeros(size)
+        valid = np.zeros(size, dtype=bool)
+        rows = np.arange(size)
+        for iter in range(max_iter):
+            if len(rows) == 0:
+                break
+            x = np.asarray(draw(rows), dtype=float)
+            samples[rows] = x
+            ok = accept(x, rows)
+            valid[rows[ok]] = True
+            rows = rows[~ok]
+
+        return samples, valid
+
+    @staticmethod
+    def sample_by_cartype(list_of_dist, type_idx, rng=None):
+        """Method to draw one sample per row from the distribution of its car type
+
+        """
+        samples = np.zeros(len(type_idx))
+        for idx, dist in enumerate(list_of_dist):
+            mask = type_idx == idx
+            if np.any(mask):
+                samples[mask] = dist.sample(N=int(np.sum(mask)), rng=rng)
+        return samples
+
     def add_trip_frequency(self):
         """Method to add nunber of occurencces for each car id
 
 
         """
-        self.df['trip_count'] = self.df.groupby('carid')['carid'].transform('count')
-        self.df['trip_cumcount']  = self.df.groupby('carid').cumcount() + 1
+        car_group = self.df.groupby('carid', sort=False)
+        self.df['trip_count'] = car_group['carid'].transform('count')
+        self.df['trip_cumcount']  = car_group.cumcount() + 1
         return None
 
 
@@ -196,7 +400,9 @@ class EVData:
         """Method to get both dependednt and independent variables
 
         """
-        df = pd.read_csv(self.csv_file)
+        #only read the columns used by the model, car type has a handful of values
+        df = pd.read_csv(self.csv_file, usecols=["houseid", "carid", "cartype", "start", "end", "mileage"])
+        df["cartype"] = df["cartype"].astype("category")
         mileage = df.loc[:, "mileage"]
         start_time = df.loc[:, "start"]
         end_time = df.loc[:, "end"]
@@ -211,7 +417,7 @@ class EVData:
 
 
         """
-        trip_group = self.df.groupby("carid")["start"].nunique()
+        trip_group = self.df.groupby("carid", sort=False)["start"].nunique()
         trips = trip_group.values #get unique trips for each car id
 
         #call distribution function
@@ -225,14 +431,8 @@ class EVData:
         """
         method to add number of cars per house
         """
-        unique_houseid = np.unique(self.houseid.values)
-        number_of_cars = np.zeros_like(unique_houseid)
-
-        for i, hid in enumerate(unique_houseid):
-            df_s = self.df.loc[self.df["houseid"] == hid]
-            #get the number of cars by house
-            unique_cars = np.unique(df_s.loc[:, "carid"].values)
-            number_of_cars[i] = len(unique_cars)
+        #get the number of cars by house in a single grouped pass
+        number_of_cars = self.df.groupby("houseid", sort=False)["carid"].nunique().values
 
         #fit number of cars by houseid
         HouseDist = Distribution(X=number_of_cars, type="categorical")
@@ -246,19 +446,26 @@ class EVData:
         method to get distributions for independent variables
 
         """
-        #fit continuous
+        self.load_data()
+        #fit continuous, start times are truncated to the day
         StartTimeDist = Distribution(X=self.start_time, type="cont")
-        StartTimeDist.fit(dist_type="lognorm")
-
-        if save_model:
-            StartTimeDist.dist.save(os.path.join(self.model_dir, "StartTimeDist.pkl"))
+        path_to_file = os.path.join(self.model_dir, "StartTimeDist.pkl")
+        path_to_table = os.path.join(self.model_dir, "StartTimeDist.npz")
 
         if load_model:
-            path_to_file = os.path.join(self.model_dir, "StartTimeDist.pkl")
-            assert os.path.exists(path_to_file)
-            dist = distfit()
-            dist.load(path_to_file)
-            StartTimeDist.dist = dist
+            if os.path.exists(path_to_table):
+                StartTimeDist.load_table(path_to_table)
+            else:
+                assert os.path.exists(path_to_file)
+                StartTimeDist.load(path_to_file)
+                StartTimeDist.compile(lower=0, upper=24)
+        else:
+            StartTimeDist.fit(dist_type="lognorm")
+            StartTimeDist.compile(lower=0, upper=24)
+
+            if save_model:
+                StartTimeDist.dist.save(path_to_file)
+                StartTimeDist.save_table(path_to_table)
 
         ##fit cartype
         CartypeDist = Distribution(X=self.car_type, type="categorical")
@@ -266,69 +473,309 @@ class EVData:
 
         return StartTimeDist, CartypeDist
 
+    def get_trip_model(self):
+        """
+        method to fit the joint duration and mileage model
+
+        """
+        self.load_data()
+        #order of each trip within its car by start time
+        trip_index = self.df.groupby("carid", sort=False)["start"].rank(method="first").values.astype(int) - 1
+        TripModelObj = TripModel(upper_avg_speed=self.upper_avg_speed)
+        TripModelObj.fit(np.asarray(self.car_type), trip_index, self.duration.values, self.mileage.values)
+        return TripModelObj
+
     def get_rest_period(self):
 
         """Get a new distribution for rest period
 
         """
+        self.load_data()
         trip_group = self.df.groupby("carid")["start"].nunique()
         #print(trip_group)
 
         return None
 
-    def get_dep_distribution(self, load_model=False, save_model=False):
+    def get_dep_distribution(
+            self,
+            load_model=False,
+            save_model=False,
+            n_workers=1,
+            candidates=None,
+            subsample=None,
+            seed=None
+    ):
         """
         method to fit duration and mileage distributions
+
+        The (cartype x variable) fits are independent and run in a process pool if n_workers > 1,
+        see fit for candidates, subsample and seed.
         """
+        self.load_data()
         #assume that duration and the mileage are dependent on the cartype
         unique_cartpe = np.unique(self.car_type)
-        unique_trips = np.unique(self.df["trip_count"].values)
+        self.cartypes = unique_cartpe
+        #row positions of each cartype, from a single grouped pass
+        cartype_rows = self.df.groupby("cartype", observed=True).indices
         #print(f"Unique: {unique_cartpe}")
         list_of_DurationDist = []
         list_of_MileageDist = []
         list_of_duration_names = []
         list_of_mileage_names = []
+        fit_tasks = []
 
         for ct in unique_cartpe:
             #for n_trip in unique_trips:
                 #specifying filenames
             duration_pkl = os.path.join(self.model_dir, f"duration_ct_{ct}.pkl")
             mileage_pkl = os.path.join(self.model_dir, f"mileage_ct_{ct}.pkl")
+            duration_npz = duration_pkl.replace(".pkl", ".npz")
+            mileage_npz = mileage_pkl.replace(".pkl", ".npz")
             list_of_duration_names.append(duration_pkl)
             list_of_mileage_names.append(mileage_pkl)
 
-            df_s = self.df.loc[self.df["cartype"] == ct]
-            duration = (df_s.loc[:, "end"] - df_s.loc[:, "start"]).values
+            rows = cartype_rows[ct]
+            duration = self.duration.values[rows]
             DurationDist = Distribution(X=duration, type="cont")
-            mileage = df_s.loc[:, "mileage"].values
+            mileage = self.mileage.values[rows]
             MileageDist = Distribution(X=mileage, type="cont")
 
-            #load model
-            if load_model:
+            #load model, compiled tables are preferred over the distfit pickles
+            if load_model and os.path.exists(duration_npz) and os.path.exists(mileage_npz):
+                DurationDist.load_table(duration_npz)
+                MileageDist.load_table(mileage_npz)
+            elif load_model:
                 #load distributions for duration and mileage
-                dist = distfit()
-                dist.load(duration_pkl)
-                DurationDist.dist = dist
-
-                dist = distfit()
-                dist.load(mileage_pkl)
-                MileageDist.dist = dist
+                DurationDist.load(duration_pkl)
+                MileageDist.load(mileage_pkl)
+                DurationDist.compile(lower=0, upper=24)
+                MileageDist.compile(lower=0)
             else:
-                #distribution
-                DurationDist.fit()
-                MileageDist.fit()
-
-                if save_model:
-                    DurationDist.dist.save(duration_pkl)
-                    MileageDist.dist.save(mileage_pkl)
+                #distribution, durations are truncated to the day and mileages to positive values
+                fit_tasks.append((DurationDist, (0, 24), duration_pkl if save_model else None))
+                fit_tasks.append((MileageDist, (0, None), mileage_pkl if save_model else None))
 
             #append objects to list
             list_of_DurationDist.append(DurationDist)
             list_of_MileageDist.append(MileageDist)
 
+        if fit_tasks:
+            task_seeds = np.random.SeedSequence(seed).spawn(len(fit_tasks))
+            task_args = [
+                (dist, support, path, candidates, subsample, task_seed)
+                for (dist, support, path), task_seed in zip(fit_tasks, task_seeds)
+            ]
+            if n_workers > 1:
+                with ProcessPoolExecutor(max_workers=n_workers) as executor:
+                    fitted = list(executor.map(_fit_task, task_args))
+            else:
+                fitted = [_fit_task(args) for args in task_args]
+
+            #pickled results come back without the training data, put back the fitted objects
+            fitted = iter(fitted)
+            for i in range(len(unique_cartpe)):
+                for list_of_dist in [list_of_DurationDist, list_of_MileageDist]:
+                    dist = next(fitted)
+                    dist.X = list_of_dist[i].X
+                    list_of_dist[i] = dist
+
         return list_of_DurationDist, list_of_MileageDist, list_of_duration_names, list_of_mileage_names
 
 
+def _fit_task(args):
+    """Fit and compile one continuous distribution, saving it if a path is given
+
+    """
+    dist, (lower, upper), path_to_file, candidates, subsample, seed = args
+    dist.fit(candidates=candidates, subsample=subsample, seed=seed)
+    dist.compile(lower=lower, upper=upper)
+    if path_to_file is not None:
+        dist.dist.save(path_to_file)
+        dist.save_table(path_to_file.replace(".pkl", ".npz"))
+    return dist
+
+
+#EVData object of the shard worker process, set once per process by the pool initializer
+_SHARD_DATA = None
+
+
+def _init_shard_worker(ev_data):
+    global _SHARD_DATA
+    _SHARD_DATA = ev_data
+
+
+def _inference_shard(args):
+    number_of_houses, seed, max_iter = args
+    df = _SHARD_DATA.inference(number_of_houses=number_of_houses, seed=seed, max_iter=max_iter, verbose=False)
+    return df, _SHARD_DATA.infeasible_trips
+
+
+class TripModel:
+    def __init__(
+            self,
+            n_levels=101,
+            max_trip_index=4,
+            n_duration_bins=5,
+            min_count=30,
+            upper_avg_speed=60
+    ):
+        """Class for the joint empirical model of trip duration and mileage
+
+        Durations are sampled from binned quantile tables conditioned on car type and trip index,
+        truncated to the time left before the next trip. Mileages are sampled as average speeds
+        conditioned on car type and duration bin, truncated to upper_avg_speed. Sampled trips are
+        therefore feasible by construction; the rare trips whose window has no mass in the table
+        are drawn uniformly within the window and counted in self.infeasible.
+
+        :param n_levels (int): number of quantiles in each table
+        :param max_trip_index (int): trips from this index on share a table
+        :param n_duration_bins (int): number of duration bins for the speed tables
+        :param min_count (int): groups with fewer trips fall back to the car type table
+        :param upper_avg_speed (float): upper limit on the average speed of a trip
+        """
+        self.n_levels = n_levels
+        self.max_trip_index = max_trip_index
+        self.n_duration_bins = n_duration_bins
+        self.min_count = min_count
+        self.upper_avg_speed = upper_avg_speed
+        self.infeasible = 0
+
+    def fit(self, cartype, trip_index, duration, mileage):
+        """Method to build the quantile tables from the observed trips
+
+        """
+        self.cartypes = np.unique(cartype)
+        ct_idx = np.searchsorted(self.cartypes, cartype)
+
+        #duration by car type and trip index
+        group = ct_idx*self.max_trip_index + np.minimum(trip_index, self.max_trip_index - 1)
+        self.duration_table = self.quantile_tables(duration, group, ct_idx, self.max_trip_index)
+
+        #average speed by car type and duration bin
+        valid = duration > 0
+        levels = np.linspace(0, 1, self.n_duration_bins + 1)[1:-1]
+        self.duration_edges = np.quantile(duration[valid], levels)
+        dbin = np.searchsorted(self.duration_edges, duration[valid], side="right")
+        group = ct_idx[valid]*self.n_duration_bins + dbin
+        self.speed_table = self.quantile_tables(mileage[valid]/duration[valid], group, ct_idx[valid], self.n_duration_bins)
+        return None
+
+    def quantile_tables(self, x, group, ct_idx, groups_per_cartype):
+        """Method to compute one row of quantiles per group, small groups use their car type
+
+        """
+        levels = np.linspace(0, 1, self.n_levels)
+        tables = np.zeros((len(self.cartypes)*groups_per_cartype, self.n_levels))
+        rows = pd.Series(np.arange(len(x))).groupby(group).indices
+        ct_rows = pd.Series(np.arange(len(x))).groupby(ct_idx).indices
+        for g in range(tables.shape[0]):
+            sel = rows.get(g, [])
+            if len(sel) < self.min_count:
+                sel = ct_rows.get(g//groups_per_cartype, np.arange(len(x)))
+            tables[g] = np.quantile(x[sel], levels)
+        return tables
+
+    def sample(self, cartype, trip_index, window, rng=None, upper_avg_speed=None):
+        """Method to sample durations in (0, window) and mileages under the speed limit
+
+        :param cartype (np.array): (n, ) car type of each trip
+        :param trip_index (np.array): (n, ) index of each trip within its car
+        :param window (np.array): (n, ) time available for each trip
+        :param upper_avg_speed (float): speed limit, the one set at fit time if None
+        :return duration (np.array), mileage (np.array), infeasible (np.array): sampled trips and
+            the mask of trips drawn uniformly because their window had no mass in the table
+        """
+        rng = np.random.default_rng(rng)
+        ct_idx = np.searchsorted(self.cartypes, cartype)
+
+        group = ct_idx*self.max_trip_index + np.minimum(trip_index, self.max_trip_index - 1)
+        duration, bad_duration = self.truncated_sample(self.duration_table, group, 0, window, rng)
+
+        dbin = np.searchsorted(self.duration_edges, duration, side="right")
+        group = ct_idx*self.n_duration_bins + dbin
+        if upper_avg_speed is None:
+            upper_avg_speed = self.upper_avg_speed
+        speed, bad_speed = self.truncated_sample(self.speed_table, group, 0, upper_avg_speed, rng)
+
+        infeasible = bad_duration | bad_speed
+        self.infeasible += int(np.sum(infeasible))
+        return duration, speed*duration, infeasible
+
+    def truncated_sample(self, tables, group, lower, upper, rng):
+        """Method to sample each row from its table truncated to (lower, upper)
+
+        """
+        p_low = self.table_cdf(tables, group, np.broadcast_to(lower, group.shape))
+        p_high = self.table_cdf(tables, group, np.broadcast_to(upper, group.shape))
+        u = p_low + rng.random(len(group))*(p_high - p_low)
+        x = self.table_ppf(tables, group, u)
+
+        #no mass of the table inside the window
+        infeasible = ~((x > lower) & (x < upper))
+        uniform = lower + rng.random(len(group))*(upper - lower)
+        return np.where(infeasible, uniform, x), infeasible
+
+    @staticmethod
+    def table_ppf(tables, group, u):
+        """Method to evaluate the inverse CDF of each row's table at u
+
+        """
+        pos = u*(tables.shape[1] - 1)
+        i = np.clip(np.floor(pos).astype(int), 0, tables.shape[1] - 2)
+        frac = pos - i
+        return tables[group, i] + frac*(tables[group, i + 1] - tables[group, i])
+
+    @staticmethod
+    def table_cdf(tables, group, x):
+        """Method to evaluate the CDF of each row's table at x
+
+        Rows are offset so that the flattened tables are sorted and a single searchsorted
+        locates x in its own row.
+        """
+        n_levels = tables.shape[1]
+        x = np.clip(x, tables.min(), tables.max())
+        span = tables.max() - tables.min() + 1
+        offset = np.arange(tables.shape[0])*span
+        pos = np.searchsorted((tables + offset[:, None]).ravel(), x + offset[group]) - group*n_levels
+
+        k = np.clip(pos, 1, n_levels - 1)
+        q0 = tables[group, k - 1]
+        q1 = tables[group, k]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            frac = np.where(q1 > q0, (x - q0)/(q1 - q0), 1.0)
+        return (k - 1 + np.clip(frac, 0, 1))/(n_levels - 1)
+
+    def to_arrays(self):
+        """Method to export the model as a dict of arrays
+
+        """
+        return {
+            "cartypes": self.cartypes,
+            "duration_table": self.duration_table,
+            "duration_edges": self.duration_edges,
+            "speed_table": self.speed_table,
+            "settings": np.array([self.max_trip_index, self.n_duration_bins, self.upper_avg_speed])
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """Method to create a model from the output of to_arrays
+
+        """
+        max_trip_index, n_duration_bins, upper_avg_speed = arrays["settings"]
+        model = cls(
+            n_levels=arrays["duration_table"].shape[1],
+            max_trip_index=int(max_trip_index),
+            n_duration_bins=int(n_duration_bins),
+            upper_avg_speed=upper_avg_speed
+        )
+        model.cartypes = arrays["cartypes"]
+        model.duration_table = arrays["duration_table"]
+        model.duration_edges = arrays["duration_edges"]
+        model.speed_table = arrays["speed_table"]
+        return model
+
+
 class Distribution:
     def __init__(self, X, type="cont"):
         """Class to fit distributions and fit distributions
@@ -338,33 +785,148 @@ class Distribution:
         """
         self.X  = X
         self.type = type
+        self.quantiles = None
 
         assert self.type in ["cont", "continuous", "categorical"]
 
 
-    def fit(self, dist_type=None):
+    def __getstate__(self):
+        """Drop the training data once fitted when pickling
+
+        The distfit model is kept, so distributions fitted in worker processes can still be saved,
+        plotted or summarized in the parent process.
+
+        """
+        state = self.__dict__.copy()
+        if self.quantiles is not None or hasattr(self, "cum_prob"):
+            state["X"] = None
+        return state
+
+    def fit(self, dist_type=None, candidates=None, subsample=None, seed=None):
 
         if self.type == "categorical":
-            self.cum_prob, self.prob = self.categorical_fit()
+            self.values, self.cum_prob, self.prob = self.categorical_fit()
         else:
             self.cum_prob = None
-            self.dist = self.cont_fit(dist_type=dist_type)
+            self.dist = self.cont_fit(dist_type=dist_type, candidates=candidates, subsample=subsample, seed=seed)
             print(f"best distribution: {self.dist.model}")
 
         return None
 
-    def cont_fit(self, dist_type=None):
+    def cont_fit(self, dist_type=None, candidates=None, subsample=None, seed=None):
+        """Method to fit a continuous distribution with distfit
+
+        :param dist_type (str): single distribution to fit
+        :param candidates (list): distributions to search, all of distfit's defaults if None
+        :param subsample (int): search the candidates on a random subsample of this size, then
+            refit only the best one on the full data and check its fit with a KS test
+        :param seed (int, np.random.SeedSequence): seed for the subsample
+        """
+        from distfit import distfit
+
+        candidates = [dist_type] if dist_type is not None else candidates
+        X = np.asarray(self.X)
+
+        #search on a subsample and keep only the best candidate for the full fit
+        refine = subsample is not None and len(X) > subsample and (candidates is None or len(candidates) > 1)
+        if refine:
+            search = distfit(todf=True) if candidates is None else distfit(distr=candidates)
+            search.fit_transform(np.random.default_rng(seed).choice(X, size=subsample, replace=False))
+            candidates = [search.model["name"]]
+
         # Initialize
-        if dist_type is None:
+        if candidates is None:
             dist = distfit(todf=True)
         else:
-            dist = distfit(distr=[dist_type])
+            dist = distfit(distr=candidates)
 
         # Search for best theoretical fit on your empirical data
-        dist.fit_transform(self.X)
+        dist.fit_transform(X)
+
+        #goodness of fit of the refined model on the full data
+        if refine:
+            from scipy import stats
+            self.ks_statistic = stats.kstest(X, dist.model["model"].cdf).statistic
+            print(f"KS statistic of {candidates[0]} on the full data: {self.ks_statistic:.4f}")
 
         return dist
 
+    def load(self, path_to_file):
+        """Method to load a fitted distfit model from a pickle
+
+        """
+        from distfit import distfit
+
+        dist = distfit()
+        dist.load(path_to_file)
+        self.dist = dist
+        return None
+
+    def compile(self, lower=None, upper=None, n_points=1001):
+        """Method to compile the fitted model into an inverse-CDF lookup table
+
+        The table holds the quantiles of the model, optionally truncated to [lower, upper], on an
+        evenly spaced grid of probabilities so that sampling is a single np.interp.
+
+        :param lower (float): lower bound of the support, None for no truncation
+        :param upper (float): upper bound of the support, None for no truncation
+        :param n_points (int): number of points in the quantile grid
+        """
+        assert hasattr(self, "dist") #check that the distribution exists
+        model = self.dist.model["model"]
+
+        #probability mass inside the support, tails are clipped to keep the quantiles finite
+        eps = 1e-6
+        p_low = eps if lower is None else max(model.cdf(lower), eps)
+        p_high = 1 - eps if upper is None else min(model.cdf(upper), 1 - eps)
+        self.levels = np.linspace(0, 1, n_points)
+        self.quantiles = model.ppf(p_low + self.levels*(p_high - p_low))
+        self.quantiles = np.clip(
+            self.quantiles,
+            -np.inf if lower is None else lower,
+            np.inf if upper is None else upper
+        )
+
+        return None
+
+    def save_table(self, path_to_file):
+        """Method to save the inverse-CDF table as .npz
+
+        """
+        assert self.quantiles is not None
+        np.savez(path_to_file, levels=self.levels, quantiles=self.quantiles)
+        return None
+
+    def to_arrays(self):
+        """Method to export the sampling state of the distribution as a dict of arrays
+
+        """
+        if self.type == "categorical":
+            return {"type": np.array(self.type), "values": self.values, "prob": self.prob, "cum_prob": self.cum_prob}
+        assert self.quantiles is not None #continuous distributions must be compiled
+        return {"type": np.array(self.type), "levels": self.levels, "quantiles": self.quantiles}
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """Method to create a distribution for sampling from the output of to_arrays
+
+        """
+        dist = cls(X=None, type=str(arrays["type"]))
+        if dist.type == "categorical":
+            dist.values, dist.prob, dist.cum_prob = arrays["values"], arrays["prob"], arrays["cum_prob"]
+        else:
+            dist.levels, dist.quantiles = arrays["levels"], arrays["quantiles"]
+        return dist
+
+    def load_table(self, path_to_file):
+        """Method to load an inverse-CDF table saved with save_table
+
+        """
+        with np.load(path_to_file) as table:
+            self.levels = table["levels"]
+            self.quantiles = table["quantiles"]
+        return None
+
     def categorical_fit(self):
 
         """
@@ -376,7 +938,7 @@ class Distribution:
         probabiltiies = counts/np.sum(counts)
         cum_prob = np.cumsum(probabiltiies, axis=-1)  # shape (n1, n2, m)
 
-        return cum_prob, probabiltiies
+        return X_u, cum_prob, probabiltiies
 
     @staticmethod
     def softmax(x):
@@ -384,27 +946,40 @@ class Distribution:
         e_x = np.exp(x - np.max(x))
         return e_x / e_x.sum()
 
-    def sample(self, N=1):
+    def sample(self, N=1, rng=None):
 
         """Method to generate samples
 
-
+        :param N (int): number of samples
+        :param rng (np.random.Generator): random generator, global numpy state if None
         """
         if self.type == "categorical":
-            samples = [self.categorical_inference() for n in range(N)]
+            samples = self.categorical_inference(N=N, rng=rng)
+        elif self.quantiles is not None:
+            #inverse-CDF sampling from the compiled table
+            uniform = np.random.uniform if rng is None else rng.uniform
+            samples = np.interp(uniform(size=N), self.levels, self.quantiles)
         else:
             assert hasattr(self, "dist") #check that the distribution exists
-            samples = self.dist.generate(n=N)
+            samples = self.dist.generate(n=N, random_state=rng)
 
         return samples
 
-    def categorical_inference(self):
+    def categorical_inference(self, N=1, rng=None):
         """
-        Generate sample based on probabilties
+        Generate samples based on probabilties
+
+        Each uniform draw is located in the cumulative probabilities with a binary search, so
+        sampling is O(N log k) for k categories.
 
+        :return samples (np.array): (N, ) array of category values
         """
-        r = np.random.uniform(size=(len(self.prob),))
-        samples = np.argmax(self.cum_prob > r, axis=-1) + 1
+        uniform = np.random.uniform if rng is None else rng.uniform
+        r = uniform(size=N)
+        idx = np.searchsorted(self.cum_prob, r, side="right")
+        #guard against round-off in the last cumulative probability
+        idx = np.minimum(idx, len(self.values) - 1)
+        samples = self.values[idx]
         return samples
 
 
@@ -515,6 +1090,7 @@ class Plotter:
             xlim=None,
             filename="test.svg"
     ):
+        import matplotlib.pyplot as plt
 
         fig, axs = plt.subplots(1, 1, tight_layout=True)
         #N, bins, patches = axs.hist(dist, bins=n_bins)